@@ -1,5 +1,33 @@
-from langchain_core.messages import BaseMessage
-from langgraph.graph import END
+import operator
+import os
+from typing import Annotated, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+from langgraph.graph import END, MessagesState
+from langgraph.prebuilt.chat_agent_executor import AgentState as ReactAgentState
+from utils.policy_engine import PolicyResult
+
+class GraphState(MessagesState):
+    # directory of the job workspace holding the staged and patched files
+    workspace: str
+    # type of the sse event that started the run, used for routing
+    event_type: str
+    # every policy evaluation of the run, the first one is the original file
+    validations: list[PolicyResult]
+    # sha256 of the patched file after each remediation round
+    patch_hashes: list[str]
+    # why the monitoring/remediation loop stopped, empty while it runs
+    stop_reason: str
+    # staged file and policies of a file remediation, agents see these instead of the whole history
+    filename: str
+    policy_paths: list[str]
+    # every message of every agent, messages only keeps what the nodes hand over
+    transcript: Annotated[list[BaseMessage], operator.add]
+
+class AgentState(ReactAgentState):
+    workspace: str
+    # tools append their evaluations, the node hands the full list back to the graph
+    validations: Annotated[list[PolicyResult], operator.add]
 
 def make_system_prompt(suffix: str) -> str:
     return (
@@ -13,6 +41,51 @@ def make_system_prompt(suffix: str) -> str:
     )
 
 
+def patched_filename(filename: str) -> str:
+    base_name, extension = os.path.splitext(filename)
+    return f"{base_name}_patched{extension}"
+
+def current_filename(state: GraphState) -> str:
+    """The latest patch once there is one, otherwise the staged file"""
+    patched = patched_filename(state["filename"])
+    return patched if os.path.exists(os.path.join(state["workspace"], patched)) else state["filename"]
+
+def compact_context(state: GraphState, content: Optional[str] = None) -> HumanMessage:
+    """What an agent needs for the next round: the current file, its latest violations and the policies"""
+    filename = current_filename(state)
+    context = f"Configuration file: {filename}\nPolicy files: {', '.join(state['policy_paths'])}\n"
+    validations = state.get("validations") or []
+    if validations:
+        latest = validations[-1]
+        context += f"Latest conftest result for {os.path.basename(latest.filename)}:\n"
+        context += "\n".join(f"- {message}" for message in latest.failures + latest.exceptions) or "- no violations"
+        context += "\n"
+    if content is not None:
+        context += f"Current content of {filename}:\n{content}\n"
+    return HumanMessage(content=context)
+
+def check_progress(previous: list[PolicyResult], current: list[PolicyResult], patch_hashes: list[str]) -> Optional[str]:
+    """Returns why the loop should stop after a monitoring round, None to keep remediating
+
+    previous and current are the evaluations before and after the round.
+    """
+    new = current[len(previous):]
+    if not new:
+        return None
+    if new[-1].compliant:
+        return "compliant"
+    # the original file has nothing to compare to, later rounds must reduce the failures
+    if previous and patch_hashes and len(new[-1].failures) >= len(previous[-1].failures):
+        return "no_progress"
+    return None
+
+def convergence_summary(state: GraphState) -> dict:
+    return {
+        "iterations": len(state.get("patch_hashes") or []),
+        "stop_reason": state.get("stop_reason") or "unknown",
+        "failing_rules": [result.failures for result in state.get("validations") or []],
+    }
+
 def get_next_node(last_message: BaseMessage, goto: str):
     if "FINAL ANSWER" in last_message.content:
         # Any agent decided the work is done
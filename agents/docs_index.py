@@ -0,0 +1,392 @@
+"""AWS CLI documentation index used by the command agent's retriever tool
+
+Indexes are stored as versioned artifacts under AWS_CLI_INDEX_PATH/<version>/, with the
+CURRENT file naming the version to serve. Build one ahead of time with:
+    python -m agents.docs_index build
+or, after replacing aws_cli.pdf with a new release, derive the new version from the current one with:
+    python -m agents.docs_index update
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import faiss
+import numpy as np
+from langchain_classic.embeddings import CacheBackedEmbeddings
+from langchain_classic.storage import LocalFileStore
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from dotenv import load_dotenv
+from utils.cache import LRUCache
+from .llm import create_embeddings
+from utils.metrics import timed
+
+load_dotenv()
+
+# stub embeddings get their own index versions and cache namespace
+embedding_model = os.getenv("EMBEDDING_MODEL", "qwen3-embedding:8b") if os.getenv("EMBEDDING_PROVIDER", "ollama") == "ollama" else "stub"
+embeddings = create_embeddings(embedding_model)
+
+# chunk embeddings are cached on disk by text hash and model, so rebuilds only embed new text
+cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+    embeddings,
+    LocalFileStore(os.getenv("EMBEDDING_CACHE_PATH", ".cache/embeddings")),
+    namespace=embedding_model,
+    key_encoder="sha256",
+)
+
+index_path = os.getenv("AWS_CLI_INDEX_PATH", "./agents/faiss_index")
+pdf_path = os.getenv("AWS_CLI_PDF_PATH", "./aws_cli.pdf")
+# faiss index_factory description of the served index, e.g. "Flat", "SQfp16", "HNSW32,Flat" or "IVF1024,PQ32"
+index_factory = os.getenv("AWS_CLI_INDEX_FACTORY", "Flat")
+
+def index_version(pdf: str) -> str:
+    digest = hashlib.sha256()
+    with open(pdf, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    model = "".join(c if c.isalnum() else "-" for c in embedding_model)
+    factory = "".join(c if c.isalnum() else "-" for c in index_factory)
+    return f"{digest.hexdigest()[:12]}-{model}-{factory}"
+
+def current_index_path() -> Optional[str]:
+    """Returns the directory of the index to serve, if one was built"""
+    version = os.getenv("AWS_CLI_INDEX_VERSION")
+    if not version and os.path.exists(os.path.join(index_path, "CURRENT")):
+        with open(os.path.join(index_path, "CURRENT")) as f:
+            version = f.read().strip()
+    if version:
+        return os.path.join(index_path, version)
+    # indexes saved before versioning live directly in the index directory
+    if os.path.exists(os.path.join(index_path, "index.faiss")):
+        return index_path
+    return None
+
+def load_index(path: str) -> FAISS:
+    # memory mapping keeps startup fast and lets workers on the same host share the pages,
+    # IO_FLAG_MMAP only covers IVF inverted lists, IO_FLAG_MMAP_IFC the codes of flat and HNSW indexes
+    index = faiss.read_index(os.path.join(path, "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_MMAP_IFC)
+    set_search_parameters(index)
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def set_search_parameters(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Applies the recall/latency knobs of approximate indexes, flat indexes have none"""
+    nprobe = nprobe or os.getenv("AWS_CLI_INDEX_NPROBE")
+    ef_search = ef_search or os.getenv("AWS_CLI_INDEX_EF_SEARCH")
+    parameters = faiss.ParameterSpace()
+    if nprobe and faiss.try_extract_index_ivf(index) is not None:
+        parameters.set_index_parameter(index, "nprobe", int(nprobe))
+    if ef_search and "HNSW" in type(faiss.downcast_index(index)).__name__:
+        parameters.set_index_parameter(index, "efSearch", int(ef_search))
+
+def compress_index(flat, factory: str):
+    """Rebuilds the vectors of a flat index into the index described by factory"""
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    index = faiss.index_factory(flat.d, factory, flat.metric_type)
+    if not index.is_trained:
+        train_size = min(len(vectors), int(os.getenv("AWS_CLI_INDEX_TRAIN_SIZE", "50000")))
+        sample = np.random.default_rng(0).choice(len(vectors), train_size, replace=False)
+        index.train(vectors[sample])
+    # vectors keep their positions, which index_to_docstore_id relies on
+    index.add(vectors)
+    return index
+
+def retriever_kwargs() -> dict:
+    k = int(os.getenv("AWS_CLI_RETRIEVER_K", "4"))
+    score_threshold = os.getenv("AWS_CLI_RETRIEVER_SCORE_THRESHOLD")
+    if score_threshold:
+        return {"search_type": "similarity_score_threshold",
+                "search_kwargs": {"k": k, "score_threshold": float(score_threshold)}}
+    return {"search_kwargs": {"k": k}}
+
+def iter_chunks(pdf: str) -> Iterator[Document]:
+    """Streams chunks page by page instead of loading the whole pdf first
+
+    Every chunk gets an id derived from its text, so the same chunk keeps its id across pdf releases.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    occurrences: dict[str, int] = {}
+    for page in PyPDFLoader(pdf).lazy_load():
+        for chunk in text_splitter.split_documents([page]):
+            digest = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+            # identical text can appear more than once, e.g. repeated option descriptions
+            occurrence = occurrences.get(digest, 0)
+            occurrences[digest] = occurrence + 1
+            chunk.id = f"{digest}-{occurrence}"
+            yield chunk
+
+def iter_batches(chunks: Iterator[Document], batch_size: int) -> Iterator[list[Document]]:
+    while batch := list(itertools.islice(chunks, batch_size)):
+        yield batch
+
+def embed_batch(batch: list[Document]) -> list[tuple[str, list[float]]]:
+    texts = [chunk.page_content for chunk in batch]
+    return list(zip(texts, cached_embeddings.embed_documents(texts)))
+
+def embed_into(db: Optional[FAISS], chunks: Iterator[Document], done: int = 0,
+               checkpoint: Optional[str] = None) -> tuple[Optional[FAISS], int]:
+    """Embeds chunks concurrently and adds them to db in order, creating it for the first batch
+
+    When a checkpoint directory is given, the partial index is saved every few batches.
+    """
+    batch_size = int(os.getenv("AWS_CLI_EMBED_BATCH_SIZE", "100"))
+    workers = int(os.getenv("AWS_CLI_EMBED_WORKERS", "4"))
+    checkpoint_every = int(os.getenv("AWS_CLI_CHECKPOINT_BATCHES", "10"))
+
+    start = time.time()
+    embedded = 0
+    batches_since_checkpoint = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        batches = iter_batches(chunks, batch_size)
+        while True:
+            # keep a bounded number of batches in flight so memory stays flat on large pdfs
+            for batch in itertools.islice(batches, workers * 2 - len(pending)):
+                pending.append((batch, executor.submit(embed_batch, batch)))
+            if not pending:
+                break
+
+            batch, future = pending.popleft()
+            text_embeddings = future.result()
+            metadatas = [chunk.metadata for chunk in batch]
+            ids = [chunk.id for chunk in batch]
+            if db is None:
+                db = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+            else:
+                db.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+
+            done += len(batch)
+            embedded += len(batch)
+            batches_since_checkpoint += 1
+            print(f"Embedded {done} chunks ({embedded / (time.time() - start):.1f} chunks/s)", end='\r')
+
+            if checkpoint and batches_since_checkpoint >= checkpoint_every:
+                _save_checkpoint(db, checkpoint, done)
+                batches_since_checkpoint = 0
+
+    if embedded:
+        print(f"\nEmbedded {embedded} chunks in {time.time() - start:.1f}s")
+    return db, done
+
+def build_index() -> str:
+    """Embeds the AWS CLI pdf into a new index version and marks it as current
+
+    Batches are embedded concurrently but added to the index in order. The partial index is
+    checkpointed every few batches, so an interrupted build resumes where it stopped.
+    """
+    version = index_version(pdf_path)
+    target = os.path.join(index_path, version)
+    checkpoint = os.path.join(f"{target}.partial", "checkpoint")
+
+    db = None
+    done = 0
+    if os.path.exists(os.path.join(checkpoint, "progress.json")):
+        with open(os.path.join(checkpoint, "progress.json")) as f:
+            done = json.load(f)["chunks"]
+        db = FAISS.load_local(checkpoint, embeddings, allow_dangerous_deserialization=True)
+        print(f"Resuming index build after {done} chunks")
+
+    print("Embedding documents in vector store")
+    db, done = embed_into(db, itertools.islice(iter_chunks(pdf_path), done, None), done, checkpoint)
+
+    if db is None:
+        raise Exception(f"No documents could be loaded from {pdf_path}")
+
+    _publish(db, version, done)
+    shutil.rmtree(f"{target}.partial", ignore_errors=True)
+    return target
+
+def update_index() -> str:
+    """Turns the current index into one for the current pdf, embedding only chunks that changed"""
+    base = current_index_path()
+    if base is None:
+        return build_index()
+
+    version = index_version(pdf_path)
+    if os.path.basename(os.path.normpath(base)) == version:
+        print(f"Index {version} is already up to date")
+        return base
+
+    db = FAISS.load_local(base, embeddings, allow_dangerous_deserialization=True)
+    if not isinstance(faiss.downcast_index(db.index), faiss.IndexFlat):
+        # compressed and graph indexes cannot drop vectors, the embedding cache keeps a rebuild cheap
+        print("Current index cannot be updated in place, rebuilding it from the embedding cache")
+        return build_index()
+    existing = set(db.index_to_docstore_id.values())
+
+    wanted = set()
+    added = []
+    for chunk in iter_chunks(pdf_path):
+        wanted.add(chunk.id)
+        if chunk.id not in existing:
+            added.append(chunk)
+    removed = existing - wanted
+
+    print(f"Updating index {os.path.basename(os.path.normpath(base))}: {len(added)} chunks added, {len(removed)} removed")
+    if removed:
+        db.delete(list(removed))
+    db, _ = embed_into(db, iter(added))
+
+    _publish(db, version, len(wanted))
+    return os.path.join(index_path, version)
+
+def _publish(db: FAISS, version: str, chunks: int):
+    target = os.path.join(index_path, version)
+    if index_factory != "Flat":
+        print(f"Compressing index into {index_factory}")
+        db.index = compress_index(db.index, index_factory)
+    db.save_local(target)
+    with open(os.path.join(target, "manifest.json"), "w") as f:
+        json.dump({"version": version, "embedding_model": embedding_model, "index_factory": index_factory,
+                   "chunks": chunks}, f, indent=2)
+    _set_current(version)
+
+def _save_checkpoint(db: FAISS, checkpoint: str, done: int):
+    # saved next to the previous checkpoint and swapped in, so a crash mid-save keeps the old one
+    staging = f"{checkpoint}.new"
+    shutil.rmtree(staging, ignore_errors=True)
+    db.save_local(staging)
+    with open(os.path.join(staging, "progress.json"), "w") as f:
+        json.dump({"chunks": done}, f)
+    shutil.rmtree(checkpoint, ignore_errors=True)
+    os.replace(staging, checkpoint)
+
+def _set_current(version: str):
+    # written then renamed so a concurrent reader never sees a partial version name
+    tmp_path = os.path.join(index_path, "CURRENT.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(index_path, "CURRENT"))
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.removeprefix("aws ")
+
+class RetrievalCache:
+    """LRU of retrieved documents keyed on normalized query text
+
+    With a similarity threshold, a query missing the exact cache is embedded and compared to
+    the queries cached so far, and reuses their documents when the cosine similarity is high
+    enough. The query embedding then also serves the index search, so misses cost no extra call.
+    """
+
+    def __init__(self, db: FAISS, max_entries: int, similarity_threshold: Optional[float] = None):
+        self.db = db
+        self.retriever = db.as_retriever(**retriever_kwargs())
+        self.cache = LRUCache(max_entries)
+        self.similarity_threshold = similarity_threshold
+        self.semantic_hits = 0
+        self._lock = threading.Lock()
+        self._vectors: deque = deque(maxlen=max_entries)
+
+    def invoke(self, query: str) -> list[Document]:
+        key = normalize_query(query)
+        documents = self.cache.get(key)
+        if documents is not None:
+            return documents
+
+        if self.similarity_threshold is None:
+            documents = self.retriever.invoke(query)
+        else:
+            vector = np.array(embeddings.embed_query(query), dtype="float32")
+            unit = vector / (np.linalg.norm(vector) or 1)
+            documents = self._similar_cached(unit)
+            if documents is None:
+                documents = self._search(vector)
+                with self._lock:
+                    self._vectors.append((unit, key))
+
+        self.cache.put(key, documents)
+        return documents
+
+    def stats(self) -> dict:
+        return {**self.cache.stats(), "semantic_hits": self.semantic_hits}
+
+    def _similar_cached(self, vector) -> Optional[list[Document]]:
+        with self._lock:
+            if not self._vectors:
+                return None
+            similarities = np.stack([cached for cached, _ in self._vectors]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            key = self._vectors[best][1]
+        # the exact lookup already counted a miss, a reuse only counts as a semantic hit
+        documents = self.cache.peek(key)
+        if documents is not None:
+            self.semantic_hits += 1
+        return documents
+
+    def _search(self, vector) -> list[Document]:
+        search_kwargs = retriever_kwargs()["search_kwargs"]
+        docs_and_scores = self.db.similarity_search_with_score_by_vector(vector.tolist(), k=search_kwargs["k"])
+        if "score_threshold" in search_kwargs:
+            # same relevance scale the score threshold retriever uses
+            relevance = self.db._select_relevance_score_fn()
+            docs_and_scores = [(doc, score) for doc, score in docs_and_scores
+                               if relevance(score) >= search_kwargs["score_threshold"]]
+        return [doc for doc, _ in docs_and_scores]
+
+class DocsIndex:
+    """Loads, or builds when missing, the documentation index on a background thread"""
+
+    def __init__(self):
+        self.db: Optional[FAISS] = None
+        self.retrieval_cache: Optional[RetrievalCache] = None
+        self.ready = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._load, name="docs-index", daemon=True).start()
+
+    @timed("retrieval")
+    def search(self, query: str) -> list[Document]:
+        return self.retrieval_cache.invoke(query)
+
+    def _load(self):
+        try:
+            path = current_index_path()
+            if path is None and os.path.exists(pdf_path):
+                print("No documentation index found, building it in the background")
+                path = build_index()
+            if path is None:
+                logging.warning("command agent trying his best, loaded without documentation rag tool")
+                return
+            db = load_index(path)
+            similarity_threshold = os.getenv("AWS_CLI_RETRIEVAL_SIMILARITY_THRESHOLD")
+            self.retrieval_cache = RetrievalCache(
+                db,
+                int(os.getenv("AWS_CLI_RETRIEVAL_CACHE_SIZE", "256")),
+                float(similarity_threshold) if similarity_threshold else None
+            )
+            self.db = db
+            print(f"Documentation index loaded from {path}")
+        except Exception:
+            logging.exception("Could not load the documentation index")
+        finally:
+            self.ready.set()
+
+if __name__ == "__main__":
+    match sys.argv[1:]:
+        case ["build"]:
+            print(f"Index written to {build_index()}")
+        case ["update"]:
+            print(f"Index written to {update_index()}")
+        case _:
+            print(__doc__)
+            sys.exit(1)
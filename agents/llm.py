@@ -0,0 +1,227 @@
+"""Chat models and embeddings shared by the agents, selected by LLM_PROVIDER and EMBEDDING_PROVIDER
+
+openai and ollama call the real services. stub answers deterministically without any network
+access, so the graph can be benchmarked offline. With LLM_CACHE_MODE set, chat models answer from
+the response cache at LLM_CACHE_PATH first, record and replay turn it into a recording of a run.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Optional, get_args
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+from langchain_core.load import dumps, loads
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_openai import ChatOpenAI
+from utils.metrics import metrics
+from utils.workspace import WORKSPACE_PLACEHOLDER, current_workspace
+
+class ResponseCache(BaseCache):
+    """SQLite store of chat model responses keyed on the prompt, the model and its call parameters
+
+    mode is read_write, record (always calls the model and stores the answer) or replay (never
+    calls it, a prompt that was not recorded is an error). Entries expire after ttl seconds and
+    the least recently used ones are evicted past max_entries.
+    """
+
+    def __init__(self, path: str, mode: str = "read_write", ttl: float = 30 * 24 * 3600, max_entries: int = 10000):
+        if mode not in ("read_write", "record", "replay"):
+            raise ValueError(f"Unknown LLM_CACHE_MODE {mode}")
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                generations TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        messages = json.loads(prompt)
+        for message in messages:
+            # graph state gives every message a random id, which must not defeat the cache
+            message.get("kwargs", {}).pop("id", None)
+        normalized = json.dumps(messages, sort_keys=True)
+        # tool results name the job workspace, which differs between events with the same file
+        if current_workspace.get():
+            normalized = normalized.replace(current_workspace.get(), WORKSPACE_PLACEHOLDER)
+        return f"{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}:{hashlib.sha256(llm_string.encode('utf-8')).hexdigest()}"
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode == "record":
+            return None
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT generations, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.mode != "replay" and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is not None:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        metrics.inc("llm_cache_lookups_total", "Chat model calls looked up in the response cache",
+                    result="miss" if row is None else "hit")
+        if row is None:
+            if self.mode == "replay":
+                raise LookupError(f"No recorded response for prompt {key}")
+            return None
+        return [loads(generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if self.mode == "replay":
+            return
+        key = self.make_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps([dumps(generation) for generation in return_val]), now, now)
+            )
+            # a recording keeps everything it captured
+            if self.mode == "read_write":
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY last_access DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+            self._conn.commit()
+
+    def clear(self, **kwargs: Any) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+class StubChatModel(BaseChatModel):
+    """Deterministic stand-in for the chat model
+
+    Asked with the run_conftest tool bound, it tests the configuration file and policies named in
+    the conversation, then reports FINAL ANSWER once conftest passes. Structured output gets the
+    schema's defaults, which is an empty patch for the remediation agent.
+    """
+    model_name: str = "stub"
+    # seconds every call takes, to stand in for the api's latency
+    latency: float = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def with_structured_output(self, schema, **kwargs: Any):
+        # required fields get the first option of a Literal, or an empty value
+        values = {
+            name: (get_args(field.annotation) or [""])[0]
+            for name, field in schema.model_fields.items() if field.is_required()
+        }
+        return RunnableLambda(lambda _: self._sleep() or schema(**values))
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        self._sleep()
+        tool_names = [tool["function"]["name"] for tool in kwargs.get("tools") or []]
+        last = messages[-1]
+        message = None
+
+        if "run_conftest" in tool_names and not isinstance(last, ToolMessage):
+            context = "\n".join(str(item.content) for item in messages if isinstance(item, HumanMessage))
+            filename = re.search(r"Configuration file: (\S+)", context)
+            policies = re.search(r"Policy files: (.+)", context)
+            if filename and policies:
+                message = AIMessage(content="", tool_calls=[{
+                    "name": "run_conftest",
+                    "args": {"filename": filename.group(1), "policy_paths": policies.group(1).split(", ")},
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                }])
+
+        if message is None:
+            if isinstance(last, ToolMessage) and " 0 failures, 0 exceptions" in str(last.content):
+                message = AIMessage(content="FINAL ANSWER: the configuration passes every policy.")
+            elif isinstance(last, ToolMessage):
+                message = AIMessage(content=f"Conftest reported these violations:\n{last.content}")
+            else:
+                message = AIMessage(content="FINAL ANSWER: no changes recommended.")
+
+        prompt_tokens = sum(len(str(item.content)) for item in messages) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(str(message.content)) // 4}
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": usage, "model_name": self.model_name}
+        )
+
+    def _sleep(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+_response_cache = None
+_llms: dict[tuple[str, str], BaseChatModel] = {}
+_llms_lock = threading.Lock()
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """The cache at LLM_CACHE_PATH, None when the path is empty or LLM_CACHE_MODE is off"""
+    global _response_cache
+    path = os.getenv("LLM_CACHE_PATH", ".cache/llm.sqlite")
+    # off by default, a cached answer would make a retried remediation repeat the patch that failed
+    mode = os.getenv("LLM_CACHE_MODE", "off")
+    if _response_cache is None and path and mode != "off":
+        _response_cache = ResponseCache(
+            path,
+            mode,
+            ttl=float(os.getenv("LLM_CACHE_TTL", str(30 * 24 * 3600))),
+            max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        )
+    return _response_cache
+
+def create_llm(model: str = "gpt-4.1-mini") -> BaseChatModel:
+    """Returns the chat model shared by every caller asking for the same model, and its connection pool"""
+    provider = os.getenv("LLM_PROVIDER", "openai")
+    with _llms_lock:
+        if (provider, model) not in _llms:
+            cache = get_response_cache()
+            match provider:
+                case "openai":
+                    llm = ChatOpenAI(model=model, cache=cache)
+                case "ollama":
+                    llm = ChatOllama(model=os.getenv("OLLAMA_MODEL", "qwen3:8b"), reasoning=False, cache=cache)
+                case "stub":
+                    llm = StubChatModel(latency=float(os.getenv("STUB_LLM_LATENCY", "0")), cache=cache)
+                case other:
+                    raise ValueError(f"Unknown LLM_PROVIDER {other}")
+            _llms[(provider, model)] = llm
+        return _llms[(provider, model)]
+
+def model_id(llm: BaseChatModel) -> str:
+    """Name of the model behind a chat model, whichever provider it comes from"""
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or llm._llm_type
+
+def create_embeddings(model: str) -> Embeddings:
+    match os.getenv("EMBEDDING_PROVIDER", "ollama"):
+        case "ollama":
+            return OllamaEmbeddings(model=model)
+        case "stub":
+            return DeterministicFakeEmbedding(size=int(os.getenv("STUB_EMBEDDING_SIZE", "256")))
+        case other:
+            raise ValueError(f"Unknown EMBEDDING_PROVIDER {other}")
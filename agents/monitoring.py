@@ -1,36 +1,40 @@
-import subprocess
+import os
+from typing import Annotated
 
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.tools import tool
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
-from langgraph.graph import MessagesState
-from langgraph.prebuilt import create_react_agent
+from langchain_core.messages import HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import InjectedToolCallId, tool
+from langgraph.graph import END, MessagesState
+from langgraph.prebuilt import InjectedState, create_react_agent
 from langgraph.types import Command
-from .base import get_next_node, make_system_prompt
+from utils.conftest import conftest_test
+from utils.metrics import timed
+from utils.policy_engine import format_result
+from .llm import create_llm
+from .base import AgentState, GraphState, check_progress, compact_context, get_next_node, make_system_prompt
 
 
 @tool
-def run_conftest(filename: str, policy_path: str) -> str:
-    """Runs a conftest on a configuration with a filename against a opa policy file"""
-    result = subprocess.run(
-        ["conftest", "test", f"tmp/{filename}", "--policy", policy_path],
-        capture_output=True
-    )
-    output = result.stdout.decode("utf-8")
+def run_conftest(filename: str, policy_paths: list[str],
+                 workspace: Annotated[str, InjectedState("workspace")],
+                 tool_call_id: Annotated[str, InjectedToolCallId]) -> Command:
+    """Runs a conftest on a configuration with a filename against all of its opa policy files at once"""
+    result = conftest_test(os.path.join(workspace, filename), policy_paths)
+    output = format_result(result)
     print(output)
-    # output += result.stderr.decode("utf-8"), not needed since tool throwing error is handled by langchain
-    return output
+    return Command(update={
+        "validations": [result],
+        "messages": [ToolMessage(output, tool_call_id=tool_call_id)],
+    })
 
-llm = ChatOpenAI(model="gpt-4.1-mini")
-# llm = ChatOllama(model="qwen3:8b", reasoning=False)
+llm = create_llm()
 
 monitoring_agent = create_react_agent(
     model=llm,
     tools=[run_conftest],
+    state_schema=AgentState,
     prompt=make_system_prompt("""
         You will only check whether the current or patched configuration passes Conftest by using the provided filename.
-        You may use the run_conftest tool to identify any issues by supplying the configuration filename and the policy file path.
+        You may use the run_conftest tool to identify any issues by supplying the configuration filename and all of the policy file paths.
         Keep your output concise and clear.
         Do not generate any fixes; a remediation colleague is responsible for producing the recommended configuration changes.
         Always use the conftest tool before determining if your task is completed.
@@ -38,16 +42,28 @@ monitoring_agent = create_react_agent(
     ),
 )
 
-def monitoring_node(state: MessagesState):
-    result = monitoring_agent.invoke(state)
+@timed("monitoring")
+def monitoring_node(state: GraphState):
+    # file remediations only hand the agent the current file, its latest violations and the policies
+    context = [compact_context(state)] if state.get("filename") else state["messages"]
+    result = monitoring_agent.invoke({"messages": context, "workspace": state["workspace"], "validations": []})
+    new_messages = result["messages"][len(context):]
+    validations = (state.get("validations") or []) + result["validations"]
+
     goto = get_next_node(result["messages"][-1], "remediation")
-    result["messages"][-1] = HumanMessage(
-        content=result["messages"][-1].content, name="monitoring"
-    )
+    stop_reason = check_progress(state.get("validations") or [], validations, state.get("patch_hashes") or [])
+    if stop_reason:
+        goto = END
+    elif goto == END:
+        stop_reason = "final_answer"
+    if stop_reason:
+        print(f"Stopping remediation: {stop_reason}")
     return Command(
         update={
-            # share internal message history of research agent with other agents
-            "messages": result["messages"],
+            "messages": [HumanMessage(content=result["messages"][-1].content, name="monitoring")],
+            "transcript": new_messages,
+            "validations": validations,
+            "stop_reason": stop_reason or "",
         },
         goto=goto,
     )
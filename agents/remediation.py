@@ -1,83 +1,93 @@
 import os
-import re
-from langchain_core.messages import HumanMessage
-from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI
-from langchain_ollama import ChatOllama
-from langgraph.graph import MessagesState
-from langgraph.prebuilt import create_react_agent
+from langchain_core.messages import HumanMessage, SystemMessage
+from langgraph.graph import END
 from langgraph.types import Command
-from .base import get_next_node, make_system_prompt
+from utils.cache import content_hash
+from utils.metrics import timed
+from utils.patching import Patch, apply_patch, number_lines
+from .llm import create_llm
+from .base import GraphState, compact_context, current_filename, make_system_prompt, patched_filename
 
 
-llm = ChatOpenAI(model="gpt-4.1-mini")
-# llm = ChatOllama(model="qwen3:8b", reasoning=False)
+llm = create_llm()
 
-remediation_agent = create_react_agent(
-    model=llm,
-    tools=[],
-    prompt=make_system_prompt(
-        """
-        You are a remediation agent responsible for fixing configuration file policy violations.
-        
-        Your task:
-        1. Analyze the monitoring agent's findings (violations and recommendations)
-        2. Generate the complete patched file content that fixes ALL policy violations
-        3. Return ONLY the patched content - no explanations, no markdown, just the raw file content
-        """
-    ),
+remediation_prompt = make_system_prompt(
+    """
+    You are a remediation agent responsible for fixing configuration file policy violations.
+
+    Your task:
+    1. Analyze the latest conftest violations of the current file
+    2. Return the edits that fix ALL policy violations of the current file, which is shown with line numbers
+       - for json files converted from properties files, use property_edits to set or remove keys
+       - for every other file, use line_edits replacing line ranges, keeping the file's indentation
+    3. Only edit what a violation requires, and return no edits when no violations are left
+    """
 )
+# the model returns an edit list instead of regenerating the whole file
+patch_llm = llm.with_structured_output(Patch)
+
+max_iterations = int(os.getenv("REMEDIATION_MAX_ITERATIONS", "5"))
 
 
-def get_filename_from_state(state: MessagesState) -> str:
-    """Extract filename from the conversation state"""
-    for message in reversed(state["messages"]):
-        if "What are the recommended changes for this file" in message.content:
-            # Extract filename from the prompt
-            match = re.search(r'for this file "([^"]+)"', str(message.content))
-            if match:
-                return match.group(1)
-    raise ValueError("Could not extract filename from conversation state. Make sure the prompt includes the filename.")
+@timed("remediation")
+def remediation_node(state: GraphState):
+    filename = state["filename"]
+    patched_path = os.path.join(state["workspace"], patched_filename(filename))
+    patch_hashes = state.get("patch_hashes") or []
 
+    if len(patch_hashes) >= max_iterations:
+        print(f"Stopping remediation: max_iterations ({max_iterations})")
+        return Command(update={"stop_reason": "max_iterations"}, goto=END)
 
-def remediation_node(state: MessagesState):
-    # Extract information from the conversation
-    filename = get_filename_from_state(state)
+    # later rounds refine the previous patch rather than starting over
+    with open(os.path.join(state["workspace"], current_filename(state)), "r") as f:
+        current_content = f.read()
 
-    # Let the LLM generate the patch
-    result = remediation_agent.invoke(state)
-    llm_response = result["messages"][-1].content
-    
-    # The LLM response should be the patched content directly
-    patched_content = llm_response.strip()
-    
-    # Get filename from the conversation state
-    base_name = os.path.splitext(filename)[0]
-    extension = os.path.splitext(filename)[1]
-    patched_filename = f"{base_name}_patched{extension}"
-    
-    # Save the patched file
-    try:
-        with open(f"tmp/{patched_filename}", "w") as f:
-            f.write(patched_content)
-        print(f"Patched file saved as tmp/{patched_filename}")
-    except Exception as e:
-        print(f"Error saving patched file: {str(e)}")
+    # only the current file, its latest violations and the policies, not the history of earlier rounds
+    context = compact_context(state, number_lines(current_content))
+    patch = patch_llm.invoke([SystemMessage(content=remediation_prompt), context])
 
-    # Create a summary message
-    summary = f""" Remediation completed:
+    stop_reason = ""
+    if patch.empty:
+        summary = f"Remediation found nothing left to change in {filename}."
+        stop_reason = "no_edits"
+    else:
+        try:
+            patched_content = apply_patch(current_content, filename, patch)
+        except ValueError as e:
+            print(f"Error applying patch: {str(e)}")
+            patched_content = None
+            summary = f"Remediation edits for {filename} could not be applied: {str(e)}"
+            stop_reason = "invalid_patch"
+
+        if patched_content is not None:
+            patch_hash = content_hash(patched_content)
+            if patched_content == current_content or patch_hash in patch_hashes:
+                # the model keeps proposing a patch that was already evaluated
+                summary = f"Remediation produced no new patch for {filename}."
+                stop_reason = "patch_unchanged"
+            else:
+                patch_hashes = patch_hashes + [patch_hash]
+                with open(patched_path, "w") as f:
+                    f.write(patched_content)
+                print(f"Patched file saved as {patched_path}")
+                summary = f""" Remediation completed:
 
 Original file: {filename}
-Patched file: {patched_filename}
+Patched file: {patched_filename(filename)}
+Edits: {patch.model_dump_json()}
 """
 
-    goto = get_next_node(result["messages"][-1], "monitoring")
-    result["messages"][-1] = HumanMessage(
-        content=summary,
-        name="remediation"
-    )
+    if stop_reason:
+        print(f"Stopping remediation: {stop_reason}")
 
+    message = HumanMessage(content=summary, name="remediation")
     return Command(
-        update={"messages": result["messages"]},
-        goto=goto,
+        update={
+            "messages": [message],
+            "transcript": [message],
+            "patch_hashes": patch_hashes,
+            "stop_reason": stop_reason,
+        },
+        goto=END if stop_reason else "monitoring",
     )
@@ -0,0 +1,154 @@
+"""Throughput and per-stage latency of the full event pipeline, offline
+
+Replays synthetic SSE events built from sample-configs through the real graph, policy engine and
+publisher, with the stub chat model and embeddings from agents/llm.py and a local stand-in for
+hachiware. Run from the repository root with conftest on the PATH (or POLICY_ENGINE=opa):
+    python -m benchmarks.pipeline --files 10 --repos 3 --workers 4
+
+Against a real provider, record its answers once and replay them for runs that cost nothing and
+produce the same conversations:
+    python -m benchmarks.pipeline --provider openai --llm-cache llm.sqlite --llm-cache-mode record
+    python -m benchmarks.pipeline --provider openai --llm-cache llm.sqlite --llm-cache-mode replay
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# (sample, name of the file in the synthetic repositories), names have to match policies.yaml
+SAMPLES = [
+    ("sample-configs/application.properties", "application.properties"),
+    ("sample-configs/application-safe.properties", "application.properties"),
+    ("sample-configs/s3.tf", "s3.tf"),
+    ("sample-configs/ecr.tf", "ecr.tf"),
+]
+TFPLAN = "sample-configs/tfplan.json"
+
+class ReportHandler(BaseHTTPRequestHandler):
+    """Stand-in for hachiware's report endpoint, counts what it receives"""
+    reports = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with ReportHandler.lock:
+            ReportHandler.reports += 1
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def build_events(files: int, repos: int, cloud_events: int, unique: bool) -> list[tuple[str, dict]]:
+    samples = []
+    for path, name in SAMPLES:
+        with open(path, "r") as f:
+            samples.append((name, f.read()))
+
+    events = []
+    for repo in range(repos):
+        for index in range(files):
+            name, content = samples[index % len(samples)]
+            if unique:
+                # distinct content defeats the conftest and remediation caches
+                content += f"\n# benchmark {repo}-{index}\n"
+            events.append((f"bench-{repo}-{index}", {
+                "type": "github_files",
+                "data": {
+                    "repository_full_name": f"benchmark/repo-{repo}",
+                    "path": f"services/service-{index}/{name}",
+                    "content": content,
+                },
+            }))
+
+    with open(TFPLAN, "r") as f:
+        resources = [change for change in json.load(f)["resource_changes"] if change["type"].startswith("aws")]
+    for index in range(cloud_events if resources else 0):
+        change = resources[index % len(resources)]
+        events.append((f"bench-cloud-{index}", {"type": change["type"], "data": change["change"]["after"]}))
+    return events
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=8, help="files per repository")
+    parser.add_argument("--repos", type=int, default=2)
+    parser.add_argument("--cloud-events", type=int, default=0, help="aws resource events from tfplan.json")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--unique", action="store_true", help="make every file's content distinct")
+    parser.add_argument("--provider", default="stub", choices=("stub", "openai", "ollama"), help="LLM_PROVIDER")
+    parser.add_argument("--llm-cache", default="", help="response cache path, none by default")
+    parser.add_argument("--llm-cache-mode", default="read_write", choices=("read_write", "record", "replay"))
+    parser.add_argument("--stub-latency", type=float, default=0, help="seconds each stub llm call takes")
+    parser.add_argument("--remediation-cache", action="store_true", help="keep the remediation cache enabled")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReportHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    scratch = tempfile.mkdtemp(prefix="pipeline-benchmark-")
+    # set before main is imported, load_dotenv does not override them
+    os.environ.update({
+        "LLM_PROVIDER": args.provider,
+        "LLM_CACHE_PATH": args.llm_cache,
+        "LLM_CACHE_MODE": args.llm_cache_mode,
+        "EMBEDDING_PROVIDER": "stub",
+        "STUB_LLM_LATENCY": str(args.stub_latency),
+        "HACHIWARE_ENDPOINT": f"http://127.0.0.1:{server.server_port}",
+        "GITHUB_TOKEN": "",
+        "WORKSPACE_ROOT": os.path.join(scratch, "workspaces"),
+        "CHECKPOINT_PATH": os.path.join(scratch, "checkpoints.sqlite"),
+        "EVENT_JOURNAL_PATH": os.path.join(scratch, "events.sqlite"),
+        "REMEDIATION_CACHE_PATH": os.path.join(scratch, "remediation.sqlite") if args.remediation_cache else "",
+        "AWS_CLI_INDEX_PATH": os.path.join(scratch, "faiss_index"),
+        "AWS_CLI_PDF_PATH": os.path.join(scratch, "missing.pdf"),
+        "PR_COALESCE_WINDOW": "0",
+    })
+
+    if args.llm_cache_mode == "replay":
+        # the client is still built, but never reaches the api
+        os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pipeline = importlib.import_module("main")
+    from utils.metrics import stage_listeners
+    from utils.workers import KeyedWorkerPool
+
+    samples: dict[str, list[float]] = {}
+    samples_lock = threading.Lock()
+    def collect(stage: str, seconds: float):
+        with samples_lock:
+            samples.setdefault(stage, []).append(seconds)
+    stage_listeners.append(collect)
+
+    events = build_events(args.files, args.repos, args.cloud_events, args.unique)
+    pool = KeyedWorkerPool(args.workers)
+    pipeline.publisher.start()
+
+    start = time.perf_counter()
+    for event_id, data in events:
+        pool.submit(pipeline.event_key(data), pipeline.handle_event, event_id, data)
+    pool.shutdown()
+    pipeline.publisher.shutdown()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{len(events)} events, {args.workers} workers, {elapsed:.2f} s, {len(events) / elapsed:.2f} events/s, "
+          f"{ReportHandler.reports} reports received")
+    print(f"peak rss {rss_after / 1024:.1f} MB ({rss_before / 1024:.1f} MB before loading the pipeline)")
+    print(f"{'stage':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'total s':>9}")
+    for stage, timings in sorted(samples.items()):
+        milliseconds = np.array(timings) * 1000
+        print(f"{stage:<22} {len(timings):>7} {np.percentile(milliseconds, 50):>9.2f} "
+              f"{np.percentile(milliseconds, 95):>9.2f} {milliseconds.sum() / 1000:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compares policy evaluation latency of the conftest subprocess and the OPA server engine
+
+Run from the repository root with conftest and opa on the PATH:
+    python -m benchmarks.policy_engine --iterations 50
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from utils.filetype import prop2json
+from utils.policy_engine import ConftestEngine, OPAServerEngine
+
+SAMPLES = [
+    ("sample-configs/application.properties", "policy/deny-application-properties.rego"),
+    ("sample-configs/s3.tf", "policy/deny-s3.rego"),
+    ("sample-configs/ecr.tf", "policy/deny-ecr.rego"),
+]
+
+def stage_samples(directory: str) -> list[tuple[str, str]]:
+    staged = []
+    for path, policy_path in SAMPLES:
+        base_name, extension = os.path.splitext(os.path.basename(path))
+        if extension == ".properties":
+            # conftest input for properties files is the converted json, same as main.py
+            target = os.path.join(directory, f"{base_name}.json")
+            prop2json(path, target)
+        else:
+            target = os.path.join(directory, os.path.basename(path))
+            with open(path, "r") as src, open(target, "w") as des:
+                des.write(src.read())
+        staged.append((target, policy_path))
+    return staged
+
+def run(engine, staged: list[tuple[str, str]], iterations: int) -> tuple[list[float], dict]:
+    timings = []
+    results = {}
+    for _ in range(iterations):
+        for path, policy_path in staged:
+            start = time.perf_counter()
+            results[path] = engine.evaluate(path, [policy_path])
+            timings.append(time.perf_counter() - start)
+    return timings, results
+
+def summarize(name: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<10} calls={len(timings):<5} mean={statistics.mean(timings) * 1000:8.2f}ms "
+          f"p50={statistics.median(timings) * 1000:8.2f}ms p95={p95 * 1000:8.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        staged = stage_samples(directory)
+        engines = [ConftestEngine(), OPAServerEngine()]
+
+        # warm up once so the opa engine has its policies uploaded and inputs parsed
+        for engine in engines:
+            run(engine, staged, 1)
+
+        outcomes = {}
+        for engine in engines:
+            timings, results = run(engine, staged, args.iterations)
+            summarize(engine.name, timings)
+            outcomes[engine.name] = {path: sorted(result.failures) for path, result in results.items()}
+
+        for path, _ in staged:
+            if outcomes["conftest"][path] != outcomes["opa"][path]:
+                print(f"Results differ for {os.path.basename(path)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Recall and latency of faiss index types for the AWS CLI documentation retriever
+
+Uses the vectors of the current docs index as the corpus and exact search as ground truth.
+Run from the repository root once an index has been built:
+    python -m benchmarks.retrieval --factory Flat --factory SQfp16 --factory "HNSW32,Flat" --factory "IVF1024,PQ32"
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from agents.docs_index import compress_index, current_index_path, embeddings, load_index, set_search_parameters
+
+# commands the command agent looks up for the cloud events we receive
+QUERIES = [
+    "authorize-security-group-ingress",
+    "revoke-security-group-ingress port 22 0.0.0.0/0",
+    "put-public-access-block block public acls",
+    "put-bucket-versioning enable versioning",
+    "put-bucket-encryption server side encryption",
+    "put-bucket-policy deny insecure transport",
+    "put-image-tag-mutability immutable",
+    "put-image-scanning-configuration scan on push",
+    "modify-db-instance no-publicly-accessible",
+    "modify-instance-metadata-options http-tokens required",
+    "enable-ebs-encryption-by-default",
+    "update-account-password-policy",
+    "create-flow-logs vpc",
+    "put-key-policy kms",
+    "update-function-configuration environment variables",
+    "attach-role-policy least privilege",
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--factory", action="append", help="faiss index_factory description, repeatable")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, help="IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, help="HNSW candidate list size per query")
+    parser.add_argument("--repeat", type=int, default=20, help="searches per query when timing")
+    args = parser.parse_args()
+
+    path = current_index_path()
+    if path is None:
+        raise SystemExit("No documentation index found, run `python -m agents.docs_index build` first")
+
+    base = faiss.downcast_index(load_index(path).index)
+    if not isinstance(base, faiss.IndexFlat):
+        raise SystemExit("Ground truth needs a flat index, build one with AWS_CLI_INDEX_FACTORY=Flat")
+    vectors = base.reconstruct_n(0, base.ntotal)
+
+    queries = np.array([embeddings.embed_query(query) for query in QUERIES], dtype="float32")
+    _, truth = base.search(queries, args.k)
+
+    print(f"{base.ntotal} vectors, {len(QUERIES)} queries, k={args.k}")
+    print(f"{'factory':<20} {'recall@k':>9} {'p50 ms':>9} {'p95 ms':>9} {'size MB':>9}")
+    for factory in args.factory or ["Flat"]:
+        flat = faiss.IndexFlat(base.d, base.metric_type)
+        flat.add(vectors)
+        index = compress_index(flat, factory) if factory != "Flat" else flat
+        set_search_parameters(index, args.nprobe, args.ef_search)
+
+        _, found = index.search(queries, args.k)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / args.k for i in range(len(QUERIES))])
+
+        timings = []
+        for _ in range(args.repeat):
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query.reshape(1, -1), args.k)
+                timings.append((time.perf_counter() - start) * 1000)
+
+        size = faiss.serialize_index(index).nbytes / (1 << 20)
+        print(f"{factory:<20} {recall:>9.3f} {np.percentile(timings, 50):>9.3f} {np.percentile(timings, 95):>9.3f} {size:>9.1f}")
+
+if __name__ == "__main__":
+    main()
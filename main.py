@@ -1,36 +1,64 @@
 import json
 import logging
 import os
-import requests
-from typing import Literal
+import signal
+import sqlite3
+import uuid
+from typing import Literal, Optional
 
 from datetime import datetime
 from dotenv import load_dotenv
 from langchain_core.messages import HumanMessage, SystemMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import START, MessagesState, StateGraph
-from langchain_ollama import ChatOllama
-from langchain_openai import ChatOpenAI
 from langgraph.types import Command
 from sseclient import SSEClient
 from pydantic import BaseModel, Field
 
-from utils.policy import retrieve_policy
+from utils.cache import RemediationCache
+from utils.events import EventJournal
+from utils.policy import retrieve_policies
+from utils.conftest import conftest_test
+from utils.policy_engine import PolicyResult
 from utils.reporting import generate_report
+from utils.fixes import apply_fixes
 from utils.filetype import json2prop, prop2json, with_filetype_conversion
-from utils.github_pr import create_pr_body, create_remediation_pr
+from utils.github_pr import create_pr_body
+from utils.metrics import LLMMetricsCallback, metrics, rounded_timings, stage_timings, start_metrics_server, timed
+from utils.publisher import Publisher
+from utils.workers import KeyedWorkerPool
+from utils.workspace import WORKSPACE_PLACEHOLDER, Workspace, cleanup_stale_workspaces, workspace_id
 
 load_dotenv()
+from agents.base import GraphState, convergence_summary
 from agents.command import command_node
+from agents.llm import create_llm, model_id
 from agents.monitoring import monitoring_node
-from agents.remediation import remediation_node
+from agents.remediation import llm as remediation_llm, remediation_node
 
 class Route(BaseModel):
     step: Literal["monitoring", "command"]
 
-llm = ChatOpenAI(model="gpt-4.1-mini")
-# llm = ChatOllama(model="qwen3:8b", reasoning=False)
+llm = create_llm()
 
-def decision_node(state: MessagesState):
+# "rules" only asks the llm when the event type and prompt shape are inconclusive, "llm" always asks it
+router_mode = os.getenv("ROUTER_MODE", "rules")
+
+def rule_based_route(state: GraphState) -> Optional[str]:
+    event_type = state.get("event_type", "")
+    if event_type == "github_files":
+        return "monitoring"
+    if event_type.startswith("aws"):
+        return "command"
+
+    content = str(state["messages"][-1].content)
+    if content.startswith("This is the file content:"):
+        return "monitoring"
+    if content.startswith("What are the recommended command fixes"):
+        return "command"
+    return None
+
+def llm_route(state: GraphState) -> str:
     router = llm.with_structured_output(Route)
     decision = router.invoke(
         [
@@ -42,35 +70,88 @@ def decision_node(state: MessagesState):
             HumanMessage(content=state["messages"][-1].content),
         ]
     )
-    print(f"{decision.step} agent was chosen.")
+    return decision.step
+
+@timed("decision")
+def decision_node(state: GraphState):
+    step = rule_based_route(state) if router_mode == "rules" else None
+    if step is None:
+        step = llm_route(state)
+    print(f"{step} agent was chosen.")
     return Command(
         update={
             # share internal message history of research agent with other agents
-            "messages": decision.step,
+            "messages": step,
         },
-        goto=decision.step,
+        goto=step,
     )
 
 
-workflow = StateGraph(MessagesState)
+workflow = StateGraph(GraphState)
 workflow.add_node("decision", decision_node)
 workflow.add_node("command", command_node)
 workflow.add_node("monitoring", monitoring_node)
 workflow.add_node("remediation", remediation_node)
 
 workflow.add_edge(START, "decision")
-graph = workflow.compile()
+
+# every run is checkpointed under its event id, so a restarted process resumes at the last completed node
+checkpoint_path = os.getenv("CHECKPOINT_PATH", ".cache/checkpoints.sqlite")
+if os.path.dirname(checkpoint_path):
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+checkpointer = SqliteSaver(sqlite3.connect(checkpoint_path, check_same_thread=False))
+graph = workflow.compile(checkpointer=checkpointer)
+
+# token usage and latency of every chat model call made in a run
+llm_metrics = LLMMetricsCallback()
+
+event_journal = EventJournal(os.getenv("EVENT_JOURNAL_PATH", ".cache/events.sqlite"))
+
+remediation_cache_path = os.getenv("REMEDIATION_CACHE_PATH", ".cache/remediation.sqlite")
+remediation_cache = RemediationCache(
+    remediation_cache_path,
+    ttl=float(os.getenv("REMEDIATION_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("REMEDIATION_CACHE_MAX_ENTRIES", "1000"))
+) if remediation_cache_path else None
 
 hachiware_endpoint = os.getenv('HACHIWARE_ENDPOINT')
 if not hachiware_endpoint:
     raise ValueError("Missing HACHIWARE_ENDPOINT env var")
 
-def run_agents(prompt: str):
+def complete_event(event_id: str):
+    # failed events are not retried on restart either, only interrupted or unpublished ones are
+    event_journal.complete(event_id)
+    checkpointer.delete_thread(workspace_id(event_id))
+    Workspace(event_id).cleanup()
+
+# events stay journaled until their report and PR are delivered
+publisher = Publisher(
+    hachiware_endpoint,
+    workers=int(os.getenv("PUBLISH_WORKERS", "2")),
+    max_pending=int(os.getenv("PUBLISH_MAX_PENDING", "64")),
+    pr_window=float(os.getenv("PR_COALESCE_WINDOW", "30")),
+    on_published=complete_event
+)
+
+def run_agents(prompt: str, workspace: Workspace, event_type: str = "", filename: str = "",
+               policy_paths: Optional[list[str]] = None):
+
+    config = {"recursion_limit": 20, "configurable": {"thread_id": workspace.job_id}, "callbacks": [llm_metrics]}
+    snapshot = graph.get_state(config)
+    if snapshot.values and not snapshot.next:
+        # the run finished before the process restarted, only its handling was interrupted
+        print(f"Reusing completed run {workspace.job_id}")
+        return snapshot.values
 
     message = HumanMessage(prompt)
-    msg_state = MessagesState(messages=[message])
-    events = graph.stream(msg_state,
-        {"recursion_limit": 20},
+    msg_state = GraphState(messages=[message], workspace=workspace.root, event_type=event_type, validations=[],
+                           patch_hashes=[], stop_reason="", filename=filename, policy_paths=policy_paths or [],
+                           transcript=[message])
+    if snapshot.next:
+        print(f"Resuming run {workspace.job_id} at {', '.join(snapshot.next)}")
+    # streaming None continues the checkpointed run instead of starting a new one
+    events = graph.stream(None if snapshot.next else msg_state,
+        config,
         stream_mode='values'
     )
     final_state = None
@@ -83,108 +164,221 @@ def run_agents(prompt: str):
 
     return final_state
 
-messages = SSEClient(f"{hachiware_endpoint}/sse", retry=5000)
+def handle_github_file(event_id: str, data: dict, remediation_start: datetime):
+    file = data["data"]
+    filename = file['path'].split("/")[-1]
+    file_content = file['content']
+
+    base_name = os.path.splitext(filename)[0]
+    extension = os.path.splitext(filename)[1]
+
+    print(file['path'])
+    if extension not in ['.tf', '.properties']:
+        return
+
+    try:
+        policy_paths = retrieve_policies(filename, file_content)
+    except Exception as e:
+        logging.error(e)
+        return
+
+    # the patch has to survive until it is published, a restart before that publishes it again
+    with Workspace(event_id, keep=True) as workspace:
+        with open(workspace.path(filename), "w") as f: # TODO: security vulnerability
+            f.write(file_content)
+
+        # parsing file into conftest compatible filetype
+        match extension:
+            case ".properties":
+                file_content = prop2json(workspace.path(filename), workspace.path(f"{base_name}.json"))
+                filename = f"{base_name}.json"
+
+        patched_filename = f"{os.path.splitext(filename)[0]}_patched{os.path.splitext(filename)[1]}"
+        original_content = file_content
+        deterministic_fixes = []
+        convergence = None
+        transcript = None
+        cache_key = RemediationCache.make_key(file_content, policy_paths, model_id(remediation_llm))
+        cached = remediation_cache.get(cache_key) if remediation_cache else None
+
+        if cached:
+            print(f"{file['path']} found in remediation cache, skipping agents")
+            with open(workspace.path(patched_filename), "w") as f:
+                f.write(cached["patched_content"])
+            original_result = PolicyResult.model_validate_json(cached["original_validation"].replace(WORKSPACE_PLACEHOLDER, workspace.root))
+            patched_result = PolicyResult.model_validate_json(cached["patched_validation"].replace(WORKSPACE_PLACEHOLDER, workspace.root))
+        else:
+            # most pushes are already compliant, which conftest alone can tell without involving the agents
+            original_result = conftest_test(workspace.path(filename), policy_paths)
+            patched_result = None
+
+            if original_result.exceptions and not original_result.failures:
+                # a file that cannot be parsed or evaluated has nothing the agents could remediate
+                logging.error(f"{file['path']} could not be evaluated, skipping agents: {'; '.join(original_result.exceptions)}")
+            elif not original_result.failures:
+                print(f"{file['path']} passed conftest, skipping agents")
+            else:
+                # violations with a known fix are patched without the llm
+                fixed_content, deterministic_fixes = apply_fixes(file_content, filename, original_result.failures)
+                # a resumed run already has a patch from the agents, which builds on these fixes
+                if deterministic_fixes and not os.path.exists(workspace.path(patched_filename)):
+                    print(f"Applied {len(deterministic_fixes)} deterministic fixes to {file['path']}")
+                    with open(workspace.path(patched_filename), "w") as f:
+                        f.write(fixed_content)
+                if deterministic_fixes:
+                    patched_result = conftest_test(workspace.path(patched_filename), policy_paths)
+
+                if patched_result is None or not patched_result.compliant:
+                    # the agents start from the partially fixed file, so they only see the remaining violations
+                    with open(workspace.path(filename), "w") as f:
+                        f.write(fixed_content)
 
-print("Agent system started")
-try:
-    for msg in messages:
-        if msg.data:
-            data = json.loads(msg.data)
-            remediation_start = datetime.now()
+                    prompt = "This is the file content:\n"
+                    prompt += fixed_content
+                    prompt += f"\nWhat are the recommended changes for this file \"{filename}\" against the policies in {', '.join(policy_paths)}?"
+
+                    final_state = run_agents(prompt, workspace, data['type'], filename, policy_paths)
+                    transcript = [{"name": message.name or message.type, "content": str(message.content)}
+                                  for message in final_state.get("transcript") or []]
+                    validations = final_state.get("validations") or []
+                    if len(validations) > 1:
+                        patched_result = validations[-1]
+                    elif os.path.exists(workspace.path(patched_filename)):
+                        # the monitoring agent can stop without testing the last patch
+                        patched_result = conftest_test(workspace.path(patched_filename), policy_paths)
+                    convergence = convergence_summary(final_state)
+                    print(f"Remediation stopped after {convergence['iterations']} iterations: {convergence['stop_reason']}")
+
+                # a remediation that stopped short of compliance is retried on the next push instead
+                if remediation_cache and patched_result is not None and patched_result.compliant \
+                        and os.path.exists(workspace.path(patched_filename)):
+                    with open(workspace.path(patched_filename), "r") as f:
+                        patched_content = f.read()
+                    remediation_cache.put(cache_key, patched_content,
+                        original_result.model_dump_json().replace(workspace.root, WORKSPACE_PLACEHOLDER),
+                        patched_result.model_dump_json().replace(workspace.root, WORKSPACE_PLACEHOLDER))
+
+        # parsing file back into original filetype
+        patched_content = None
+        parsed_patched_content = None
+        if os.path.exists(workspace.path(patched_filename)):
+            with open(workspace.path(patched_filename), "r") as f:
+                patched_content = f.read()
+            match extension:
+                case ".properties":
+                    parsed_patched_content = json2prop(workspace.path(patched_filename), workspace.path(f"{base_name}_patched{extension}"))
+
+        approval_data = generate_report(remediation_start, file['path'], original_content,
+                        original_result, patched_result, patched_content, parsed_patched_content,
+                        deterministic_fixes, convergence, transcript)
+
+        approval_data["type"] = "code"
+        approval_data["timing"]["stages"] = rounded_timings(stage_timings.get() or {})
+
+        # Create GitHub PR with remediation changes, the publisher sends it in the background
+        remediation_patch_content = parsed_patched_content if parsed_patched_content is not None else patched_content
+
+        if approval_data['policy_compliance']['validation_status'] == 'FAILED':
+            if remediation_patch_content is not None:
+                pr_body = create_pr_body(approval_data)
+                publisher.publish_pr(remediation_patch_content, file['path'], file['repository_full_name'], pr_body, event_id)
+
+            publisher.publish_report(approval_data, event_id)
+
+def handle_cloud_resource(event_id: str, data: dict, remediation_start: datetime):
+    contents = data["data"]
+
+    prompt = "What are the recommended command fixes for the cloud resource below?\n"
+    prompt += json.dumps(contents, indent=2)
+
+    with Workspace(event_id, keep=True) as workspace:
+        final_state = run_agents(prompt, workspace, data['type'])
+
+    remediation_end = datetime.now()
+    total_duration = (remediation_end - remediation_start).total_seconds()
+    attributes = {
+        "type": "cloud",
+        "command": final_state["messages"][-1].content,
+        "name": data['type'],
+        "timing": {
+            "remediation_start_time": remediation_start.isoformat() + "Z", #TODO: change to time of commit/change time
+            "remediation_end_time": remediation_end.isoformat() + "Z",
+            "total_duration_seconds": round(total_duration, 2)
+        }
+    }
+    attributes["type"] = "cloud"
+    attributes["timing"]["stages"] = rounded_timings(stage_timings.get() or {})
+    publisher.publish_report(attributes, event_id)
+
+def handle_event(event_id: str, data: dict):
+    remediation_start = datetime.now()
+    # collects the stage timings of this event for its report
+    token = stage_timings.set({})
+    publisher.begin(event_id)
+    outcome = "failed"
+    try:
+        with timed("event"):
             match data['type']:
                 case "github_files":
-                    file = data["data"]
-                    filename = file['path'].split("/")[-1]
-                    file_content = file['content']
-
-                    base_name = os.path.splitext(filename)[0]
-                    extension = os.path.splitext(filename)[1]
-
-                    print(file['path'])
-                    if extension not in ['.tf', '.properties']:
-                        continue
-
-                    if not os.path.isdir("tmp"):
-                        os.mkdir("tmp")
-                    with open(f"tmp/{filename}", "w") as f: # TODO: security vulnerability
-                        f.write(file_content)
-
-                    try:
-                        policy_path = retrieve_policy(filename)
-                    except Exception as e:
-                        logging.error(e)
-                        continue
-
-                    # parsing file into conftest compatible filetype
-                    match extension:
-                        case ".properties":
-                            file_content = prop2json(f"tmp/{filename}", f"tmp/{base_name}.json")
-                            filename = f"{base_name}.json"
-
-                    prompt = "This is the file content:\n"
-                    prompt += file_content
-                    prompt += f"\nWhat are the recommended changes for this file \"{filename}\" against the policy in {policy_path}?"
-
-                    final_state = run_agents(prompt)
-
-                    # parsing file back into original filetype
-                    match extension:
-                        case ".properties":
-                            file_content = json2prop(f"tmp/{base_name}_patched.json", f"tmp/{base_name}_patched{extension}")
-                            final_state["parsed_patched_content"] = file_content
-
-                    approval_data = generate_report(remediation_start,
-                                    final_state["messages"],
-                                    file['path'],
-                                    final_state["parsed_patched_content"] if "parsed_patched_content" in final_state else None)
-
-                    approval_data["type"] = "code"
-
-                    # Create GitHub PR with remediation changes
-                    remediation_patch_path = f"tmp/{base_name}_patched{extension}"
-
-                    if approval_data['policy_compliance']['validation_status'] == 'FAILED':
-                        pr_body = create_pr_body(approval_data)
-                        create_remediation_pr(remediation_patch_path, file['path'], file['repository_full_name'], pr_body=pr_body)
-
-                        res = requests.post(f'{hachiware_endpoint}/api/report', 
-                            json={ "data": { "attributes": approval_data }}, 
-                            headers={"Content-Type": "application/vnd.api+json"}
-                        )
-                        if res.status_code >= 400:
-                            print(res.json())
-
+                    handle_github_file(event_id, data, remediation_start)
                 case case if case.startswith("aws"):
-                    contents = data["data"]
-
-                    prompt = "What are the recommended command fixes for the cloud resource below?\n"
-                    prompt += json.dumps(contents, indent=2)
-
-                    final_state = run_agents(prompt)
-
-                    remediation_end = datetime.now()
-                    total_duration = (remediation_end - remediation_start).total_seconds()
-                    attributes = {
-                        "type": "cloud",
-                        "command": final_state["messages"][-1].content,
-                        "name": data['type'],
-                        "timing": {
-                            "remediation_start_time": remediation_start.isoformat() + "Z", #TODO: change to time of commit/change time
-                            "remediation_end_time": remediation_end.isoformat() + "Z",
-                            "total_duration_seconds": round(total_duration, 2)
-                        }
-                    }
-                    attributes["type"] = "cloud"
-                    res = requests.post(f'{hachiware_endpoint}/api/report', 
-                        json={ "data": { "attributes": attributes }}, 
-                        headers={"Content-Type": "application/vnd.api+json"}
-                    )
-                    if res.status_code >= 400:
-                        print(res.json())
-
-except KeyboardInterrupt:
-    print("Interrupt detected, terminating gracefully")
-    messages.resp.close()
+                    handle_cloud_resource(event_id, data, remediation_start)
+        outcome = "handled"
+    finally:
+        metrics.inc("events_total", "SSE events processed", type=data['type'], outcome=outcome)
+        stage_timings.reset(token)
+        publisher.end(event_id)
+
+def event_key(data: dict) -> Optional[str]:
+    """Events sharing a key are processed in order, everything else runs concurrently"""
+    if data['type'] == "github_files":
+        file = data["data"]
+        return f"{file['repository_full_name']}:{file['path']}"
+    return None
+
+def main():
+    concurrency = int(os.getenv("AGENT_CONCURRENCY", "4"))
+    max_pending = os.getenv("AGENT_MAX_PENDING")
+    pending = event_journal.pending()
+    cleanup_stale_workspaces(keep=[event_id for event_id, _ in pending])
+    pool = KeyedWorkerPool(concurrency, int(max_pending) if max_pending else None)
+    publisher.start()
+    # docker stop sends SIGTERM, which drains like a first Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    metrics_port = os.getenv("METRICS_PORT", "9464")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+
+    print(f"Agent system started with {concurrency} workers")
+    if pending:
+        print(f"Resuming {len(pending)} events interrupted by the last shutdown")
+    for event_id, data in pending:
+        pool.submit(event_key(data), handle_event, event_id, data)
+
+    # the server replays what was sent after the last event this process received
+    messages = SSEClient(f"{hachiware_endpoint}/sse", last_id=event_journal.last_event_id(), retry=5000)
+
+    try:
+        for msg in messages:
+            if msg.data:
+                data = json.loads(msg.data)
+                event_id = msg.id or uuid.uuid4().hex
+                if event_journal.record(event_id, data, msg.id):
+                    pool.submit(event_key(data), handle_event, event_id, data)
+
+    except KeyboardInterrupt:
+        print("Interrupt detected, terminating gracefully")
+        messages.resp.close()
+        try:
+            print("Waiting for in-flight events to finish, interrupt again to abort")
+            pool.shutdown()
+            publisher.shutdown()
+        except KeyboardInterrupt:
+            # whatever was not published stays journaled and is handled again on the next start
+            pool.shutdown(cancel=True)
+
+if __name__ == "__main__":
+    main()
 
 # with open("tmp/application.properties", "r") as f:
 #     contents = f.read()
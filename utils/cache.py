@@ -0,0 +1,139 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+def normalize_content(content: str) -> str:
+    """Drops differences that do not change how a configuration is evaluated"""
+    lines = [line.rstrip() for line in content.replace("\r\n", "\n").split("\n")]
+    return "\n".join(lines).strip()
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(normalize_content(content).encode("utf-8")).hexdigest()
+
+# policy files rarely change, so their digests are reused until the file is modified
+_file_digests: dict[str, tuple[int, int, str]] = {}
+
+def file_hash(path: str) -> str:
+    stat = os.stat(path)
+    cached = _file_digests.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _file_digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+def files_hash(paths: Iterable[str]) -> str:
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(path.encode("utf-8"))
+        digest.update(file_hash(path).encode("utf-8"))
+    return digest.hexdigest()
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache that counts hits and misses"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """Like get, without counting a hit or a miss"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+class RemediationCache:
+    """SQLite store of finished remediations keyed on (file content, policy, model)
+
+    Entries expire after ttl seconds and the least recently used ones are evicted
+    once the cache grows past max_entries.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS remediations (
+                key TEXT PRIMARY KEY,
+                patched_content TEXT NOT NULL,
+                original_validation TEXT NOT NULL,
+                patched_validation TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(content: str, policy_paths: Iterable[str], model: str) -> str:
+        return f"{content_hash(content)}:{files_hash(policy_paths)}:{model}"
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT patched_content, original_validation, patched_validation, created_at FROM remediations WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[3] > self.ttl:
+                self._conn.execute("DELETE FROM remediations WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE remediations SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        return {
+            "patched_content": row[0],
+            "original_validation": row[1],
+            "patched_validation": row[2],
+        }
+
+    def put(self, key: str, patched_content: str, original_validation: str, patched_validation: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO remediations VALUES (?, ?, ?, ?, ?, ?)",
+                (key, patched_content, original_validation, patched_validation, now, now)
+            )
+            self._conn.execute("DELETE FROM remediations WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM remediations WHERE key NOT IN (SELECT key FROM remediations ORDER BY last_access DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
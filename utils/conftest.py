@@ -0,0 +1,44 @@
+import os
+
+from utils.cache import LRUCache, content_hash, files_hash
+from utils.metrics import timed
+from utils.policy_engine import PolicyResult, get_policy_engine
+
+# results name the tested file, which differs between callers testing the same content
+PATH_PLACEHOLDER = "$CONFTEST_INPUT"
+
+results_cache = LRUCache(int(os.getenv("CONFTEST_CACHE_SIZE", "512")))
+
+def _cache_key(path: str, policy_paths: list[str]) -> tuple:
+    with open(path, "r") as f:
+        content = f.read()
+    # the extension decides which parser conftest uses
+    return (content_hash(content), os.path.splitext(path)[1], files_hash(policy_paths), get_policy_engine().name)
+
+def conftest_test(path: str, policy_paths: list[str]) -> PolicyResult:
+    """Tests a staged configuration file against a set of policies with the configured policy engine"""
+    return conftest_test_batch([path], policy_paths)[path]
+
+@timed("conftest")
+def conftest_test_batch(paths: list[str], policy_paths: list[str]) -> dict[str, PolicyResult]:
+    """Tests many files in one pass of the policy engine
+
+    With the conftest engine this is a single `conftest test --output json` process.
+    """
+    results = {}
+    keys = {}
+    for path in paths:
+        keys[path] = _cache_key(path, policy_paths)
+        cached = results_cache.get(keys[path])
+        if cached is not None:
+            results[path] = PolicyResult.model_validate_json(cached.replace(PATH_PLACEHOLDER, path))
+
+    pending = [path for path in paths if path not in results]
+    if pending:
+        for path, result in get_policy_engine().evaluate_batch(pending, policy_paths).items():
+            results[path] = result
+            # exceptions are usually environmental (missing binary, unreachable server), so they are retried
+            if not result.exceptions:
+                results_cache.put(keys[path], result.model_dump_json().replace(path, PATH_PLACEHOLDER))
+
+    return results
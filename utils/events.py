@@ -0,0 +1,56 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+class EventJournal:
+    """SQLite record of the SSE stream position and of the events still being processed
+
+    An event is journaled when it is received and removed once handled, so the events a
+    restarted process finds are the ones it has to resume, and the stream reconnects with
+    the last received id as Last-Event-ID.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cursor (id INTEGER PRIMARY KEY CHECK (id = 0), last_event_id TEXT NOT NULL)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending (
+                event_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                received_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def last_event_id(self) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT last_event_id FROM cursor").fetchone()
+        return row[0] if row else None
+
+    def record(self, event_id: str, data: dict, stream_id: Optional[str] = None) -> bool:
+        """Journals a received event, returns False when it is already pending"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO pending VALUES (?, ?, ?)", (event_id, json.dumps(data), time.time())
+            )
+            if stream_id:
+                self._conn.execute("INSERT OR REPLACE INTO cursor VALUES (0, ?)", (stream_id,))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def complete(self, event_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM pending WHERE event_id = ?", (event_id,))
+            self._conn.commit()
+
+    def pending(self) -> list[tuple[str, dict]]:
+        """Events received but not handled yet, oldest first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT event_id, data FROM pending ORDER BY received_at").fetchall()
+        return [(event_id, json.loads(data)) for event_id, data in rows]
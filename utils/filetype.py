@@ -2,30 +2,33 @@ import json
 import sys
 import os
 
+from utils.metrics import timed
+
 # converts filetypes for conftest compatibility
 def with_filetype_conversion(func):
     def wrapper(*args, **kwargs):
-        file_content, filename, policy_path = args
+        file_content, filename, policy_path, workspace = args
         base_name = os.path.splitext(filename)[0]
         extension = os.path.splitext(filename)[1]
 
         # parsing file into conftest compatible filetype
         match extension:
             case ".properties":
-                file_content = prop2json(f"tmp/{filename}", f"tmp/{base_name}.json")
+                file_content = prop2json(os.path.join(workspace, filename), os.path.join(workspace, f"{base_name}.json"))
                 filename = f"{base_name}.json"
 
-        result = func(*(file_content, filename, policy_path), **kwargs)
+        result = func(*(file_content, filename, policy_path, workspace), **kwargs)
 
         # parsing file back into original filetype
         match extension:
             case ".properties":
-                file_content = json2prop(f"tmp/{base_name}_patched.json", f"tmp/{base_name}_patched{extension}")
+                file_content = json2prop(os.path.join(workspace, f"{base_name}_patched.json"), os.path.join(workspace, f"{base_name}_patched{extension}"))
                 result["parsed_patched_content"] = file_content
 
         return result
     return wrapper
 
+@timed("file_conversion")
 def prop2json(src, des):
     file_path = src
 
@@ -50,6 +53,7 @@ def prop2json(src, des):
 
     return des_content
 
+@timed("file_conversion")
 def json2prop(src, des):
     file_path = src
 
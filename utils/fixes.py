@@ -0,0 +1,173 @@
+import json
+import os
+import re
+from typing import Callable, Optional
+
+from utils.metrics import timed
+
+# (extension of the conftest input, pattern of the violation message, fix)
+FIXES: list[tuple[str, re.Pattern, Callable]] = []
+
+def register_fix(extension: str, message_pattern: str):
+    """Registers a deterministic fix for violations whose message matches message_pattern
+
+    Fixes for .json (converted properties) receive the parsed document, fixes for .tf the raw
+    text, along with the regex match of the message. They return the fixed document, or the
+    document unchanged when they cannot fix it.
+    """
+    def decorator(func: Callable):
+        FIXES.append((extension, re.compile(message_pattern), func))
+        return func
+    return decorator
+
+@timed("deterministic_fixes")
+def apply_fixes(content: str, filename: str, failures: list[str]) -> tuple[str, list[str]]:
+    """Applies every registered fix matching the failures and returns the content with the fixed failures"""
+    extension = os.path.splitext(filename)[1]
+    document = json.loads(content) if extension == ".json" else content
+
+    fixed = []
+    for failure in failures:
+        for fix_extension, pattern, fix in FIXES:
+            match = pattern.search(failure)
+            if fix_extension != extension or not match:
+                continue
+            before = json.dumps(document) if extension == ".json" else document
+            document = fix(document, match)
+            after = json.dumps(document) if extension == ".json" else document
+            if before != after:
+                fixed.append(failure)
+            break
+
+    if not fixed:
+        return content, fixed
+    return (json.dumps(document, indent=2) if extension == ".json" else document), fixed
+
+# --- application.properties ---
+
+def env_placeholder(key: str) -> str:
+    return "${" + re.sub(r"[^A-Za-z0-9]", "_", key).upper() + "}"
+
+def set_property(key: str, value: Optional[str] = None):
+    """Fix setting key to value, or to an environment variable placeholder when value is None"""
+    def fix(props: dict, match: re.Match) -> dict:
+        if key not in props:
+            return props
+        return {**props, key: value if value is not None else env_placeholder(key)}
+    return fix
+
+PROPERTY_FIXES = {
+    r"^Hardcoded DB password found": set_property("spring.datasource.password"),
+    r"^Exposes all actuator endpoints": set_property("management.endpoints.web.exposure.include", "health,info"),
+    r"^Actuator health details exposed": set_property("management.endpoint.health.show-details", "when-authorized"),
+    r"^Debug logging enabled": set_property("logging.level.root", "INFO"),
+    r"^Hardcoded OAuth2 client secret found": set_property("security.oauth2.client.client-secret"),
+    r"^Hardcoded JWT secret found": set_property("jwt.secret"),
+    r"^CORS allowed for all origins": set_property("app.cors.allowed-origins"),
+    r"^Hardcoded file upload directory found": set_property("file.upload-dir"),
+    r"^Hardcoded mail password found": set_property("spring.mail.password"),
+    r"^Debug mode enabled": set_property("app.debug", "false"),
+    r"^Administrative interface open": set_property("app.admin.open", "false"),
+}
+
+for message_pattern, fix in PROPERTY_FIXES.items():
+    register_fix(".json", message_pattern)(fix)
+
+# --- terraform ---
+
+def find_block(text: str, header: str, start: int = 0, end: Optional[int] = None) -> Optional[tuple[int, int]]:
+    """Returns the span between the braces of the first block whose header matches, braces excluded"""
+    match = re.compile(header + r"\s*\{").search(text, start, len(text) if end is None else end)
+    if not match:
+        return None
+    depth = 1
+    in_string = False
+    position = match.end()
+    while position < len(text):
+        char = text[position]
+        if char == '"' and text[position - 1] != "\\":
+            in_string = not in_string
+        elif not in_string and char == "{":
+            depth += 1
+        elif not in_string and char == "}":
+            depth -= 1
+            if depth == 0:
+                return match.end(), position
+        position += 1
+    return None
+
+def top_level_lines(text: str, span: tuple[int, int]):
+    """Yields (start, end) of the lines directly inside a block, skipping nested blocks"""
+    depth = 0
+    position = span[0]
+    for line in text[span[0]:span[1]].split("\n"):
+        if depth == 0:
+            yield position, position + len(line)
+        depth += line.count("{") - line.count("}")
+        position += len(line) + 1
+
+def set_attribute(text: str, span: tuple[int, int], key: str, value: str) -> str:
+    for line_start, line_end in top_level_lines(text, span):
+        match = re.match(rf"(\s*){re.escape(key)}\s*=", text[line_start:line_end])
+        if match:
+            return text[:line_start] + f"{match.group(1)}{key} = {value}" + text[line_end:]
+    return insert_lines(text, span, [f"{key} = {value}"])
+
+def insert_lines(text: str, span: tuple[int, int], lines: list[str]) -> str:
+    """Appends lines at the end of a block, indented like the block's own attributes"""
+    body = text[span[0]:span[1]]
+    indents = re.findall(r"\n([ \t]+)\S", body)
+    closing_indent = re.search(r"\n([ \t]*)$", body)
+    indent = indents[0] if indents else (closing_indent.group(1) if closing_indent else "") + "  "
+    insertion = "".join(f"{indent}{line}\n" for line in lines)
+    if closing_indent:
+        position = span[1] - len(closing_indent.group(1))
+        return text[:position] + insertion + text[position:]
+    return text[:span[1]] + "\n" + insertion + text[span[1]:]
+
+def resource_block(text: str, resource_type: str, name: str) -> Optional[tuple[int, int]]:
+    return find_block(text, rf'resource\s+"{re.escape(resource_type)}"\s+"{re.escape(name)}"')
+
+def set_resource_attribute(resource_type: str, key: str, value: str):
+    def fix(text: str, match: re.Match) -> str:
+        span = resource_block(text, resource_type, match.group("name"))
+        return set_attribute(text, span, key, value) if span else text
+    return fix
+
+def set_nested_attribute(resource_type: str, block: str, key: str, value: str):
+    """Fix setting key inside a nested block of a resource, adding the block when it is missing"""
+    def fix(text: str, match: re.Match) -> str:
+        span = resource_block(text, resource_type, match.group("name"))
+        if not span:
+            return text
+        nested = find_block(text, rf"(?<![\w-]){re.escape(block)}", span[0], span[1])
+        if nested:
+            return set_attribute(text, nested, key, value)
+        return insert_lines(text, span, [f"{block} {{", f"  {key} = {value}", "}"])
+    return fix
+
+NAME = r"[`'\"]?(?P<name>[\w-]+)[`'\"]?"
+
+TERRAFORM_FIXES = {
+    rf"^ECR repository {NAME} does not have image tag mutability set":
+        set_resource_attribute("aws_ecr_repository", "image_tag_mutability", '"IMMUTABLE"'),
+    rf"^ECR repository {NAME} is not set to immutable":
+        set_resource_attribute("aws_ecr_repository", "image_tag_mutability", '"IMMUTABLE"'),
+    rf"^ECR repository {NAME} should have image_scanning_configuration defined":
+        set_nested_attribute("aws_ecr_repository", "image_scanning_configuration", "scan_on_push", "true"),
+    rf"^ECR repository {NAME} should have scan_on_push enabled":
+        set_nested_attribute("aws_ecr_repository", "image_scanning_configuration", "scan_on_push", "true"),
+    rf"^S3 bucket {NAME} does not have versioning enabled":
+        set_nested_attribute("aws_s3_bucket_versioning", "versioning_configuration", "status", '"Enabled"'),
+    rf"^S3 bucket {NAME} does not ignore public acls":
+        set_resource_attribute("aws_s3_bucket_public_access_block", "ignore_public_acls", "true"),
+    rf"^S3 bucket {NAME} does not restrict public buckets":
+        set_resource_attribute("aws_s3_bucket_public_access_block", "restrict_public_buckets", "true"),
+    rf"^S3 bucket {NAME} does not block public policy":
+        set_resource_attribute("aws_s3_bucket_public_access_block", "block_public_policy", "true"),
+    rf"^S3 bucket {NAME} does not block public acls":
+        set_resource_attribute("aws_s3_bucket_public_access_block", "block_public_acls", "true"),
+}
+
+for message_pattern, fix in TERRAFORM_FIXES.items():
+    register_fix(".tf", message_pattern)(fix)
@@ -1,8 +1,14 @@
 import os
 import re
-from github import Github
+import threading
+import uuid
+from typing import Optional
+from github import Auth, Github, InputGitTreeElement
 from datetime import datetime
 
+# GitHub rejects PR bodies longer than this
+MAX_PR_BODY = 65536
+
 def create_pr_body(data):
     pr_body = f"""# Policy Remediation Report
 
@@ -56,53 +62,92 @@ def create_pr_body(data):
 
     return pr_body
 
+_client = None
+_client_lock = threading.Lock()
+
+def get_github_client() -> Optional[Github]:
+    """Returns the GitHub client shared by every PR, None when GITHUB_TOKEN is not set
+
+    GITHUB_API_URL points it at GitHub Enterprise or a local stand-in server.
+    """
+    global _client
+    with _client_lock:
+        if _client is None and os.getenv("GITHUB_TOKEN"):
+            _client = Github(
+                auth=Auth.Token(os.getenv("GITHUB_TOKEN")),
+                base_url=os.getenv("GITHUB_API_URL", "https://api.github.com"),
+                pool_size=int(os.getenv("PUBLISH_WORKERS", "2")),
+                lazy=True
+            )
+        return _client
+
+def create_batch_pr_body(files: dict[str, str]) -> str:
+    """Aggregates the PR bodies of several files of one repository, keyed on their path"""
+    if len(files) == 1:
+        return next(iter(files.values()))
+
+    pr_body = "# Policy Remediation Report\n\n"
+    pr_body += f"**Files Remediated:** {len(files)}\n\n"
+    pr_body += "".join(f"- `{path}`\n" for path in files)
+    for path, body in files.items():
+        # each file report becomes a section, one heading level down
+        body = re.sub(r"^# Policy Remediation Report", f"# `{path}`", body, count=1)
+        pr_body += "\n---\n\n" + demote_headings(body)
+
+    if len(pr_body) > MAX_PR_BODY:
+        pr_body = pr_body[:MAX_PR_BODY - 100]
+        # an odd number of fences means the cut is inside a code block
+        if pr_body.count("\n```") % 2:
+            pr_body += "\n```"
+        pr_body += "\n\n_Report truncated, see the hachiware dashboard for the rest._\n"
+    return pr_body
+
+def demote_headings(body: str) -> str:
+    """Adds a level to every markdown heading, leaving comments inside code blocks alone"""
+    lines = []
+    in_fence = False
+    for line in body.split("\n"):
+        if line.startswith("```"):
+            in_fence = not in_fence
+        elif not in_fence:
+            line = re.sub(r"^(#+) ", r"#\1 ", line)
+        lines.append(line)
+    return "\n".join(lines)
+
 def create_remediation_pr(
-    patched_file_path: str,
-    original_file_path: str,
+    files: dict[str, str],
     repo_full_name: str,
     pr_title: str = "Automated Remediation Patch",
     pr_body: str = "This PR contains automated security/configuration remediations.",
     base_branch: str = "main"
 ):
-    GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
+    """Commits the patched content of every file, keyed on its path in the repository, to one branch and opens a PR
+
+    The commit is built with the Git Data API, so the number of calls does not grow with the number of files.
+    """
+    g = get_github_client()
     GITHUB_REPO = repo_full_name
-    if not GITHUB_TOKEN or not GITHUB_REPO:
+    if not g or not GITHUB_REPO:
         print("GITHUB_TOKEN or GITHUB_REPO not set in environment.")
         return
 
-    with open(patched_file_path, "r") as f:
-        file_content = f.read()
-    
-    filename = original_file_path
-    
     try:
-        g = Github(GITHUB_TOKEN)
-        github_repo = g.get_repo(GITHUB_REPO)
-        
-        branch_name = f"remediation-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        # lazy skips fetching the repository itself, only its refs and git objects are used
+        github_repo = g.get_repo(GITHUB_REPO, lazy=True)
+
+        # the suffix keeps batches flushed within the same second apart
+        branch_name = f"remediation-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
 
         base_ref = github_repo.get_git_ref(f"heads/{base_branch}")
-        base_sha = base_ref.object.sha
-        
-        github_repo.create_git_ref(ref=f"refs/heads/{branch_name}", sha=base_sha)
-        
-        try:
-            existing_file = github_repo.get_contents(filename, ref=branch_name)
-            github_repo.update_file(
-                path=filename,
-                message=pr_title,
-                content=file_content,
-                sha=existing_file.sha,
-                branch=branch_name
-            )
-        except:
-            github_repo.create_file(
-                path=filename,
-                message=pr_title,
-                content=file_content,
-                branch=branch_name
-            )
-        
+        base_commit = github_repo.get_git_commit(base_ref.object.sha)
+
+        tree = github_repo.create_git_tree(
+            [InputGitTreeElement(path, "100644", "blob", content=content) for path, content in files.items()],
+            base_commit.tree
+        )
+        commit = github_repo.create_git_commit(pr_title, tree, [base_commit])
+        github_repo.create_git_ref(ref=f"refs/heads/{branch_name}", sha=commit.sha)
+
         pr = github_repo.create_pull(
             title=pr_title,
             body=pr_body,
@@ -114,4 +159,5 @@ def create_remediation_pr(
         
     except Exception as e:
         print(f"Error creating PR: {e}")
-        return None
+        # the publisher keeps the events journaled, so the PR is attempted again after a restart
+        raise
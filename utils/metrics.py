@@ -0,0 +1,160 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# per-stage timings of the event being processed, set by the worker handling it
+stage_timings: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("stage_timings", default=None)
+# called with every (stage, seconds) recorded, the benchmarks use it to collect raw samples
+stage_listeners: list[Callable[[str, float], None]] = []
+
+def format_labels(labels: tuple) -> str:
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+class Metrics:
+    """In-process counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: dict[str, tuple[str, str]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, list]] = {}
+        self._gauges: dict[str, Callable[[], dict[str, float]]] = {}
+
+    def inc(self, name: str, help: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, help: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            # bucket counts, then count and sum
+            series = self._histograms.setdefault(name, {}).setdefault(key, [0] * len(BUCKETS) + [0, 0.0])
+            index = bisect.bisect_left(BUCKETS, value)
+            if index < len(BUCKETS):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def register_gauges(self, name: str, help: str, collect: Callable[[], dict[str, float]]):
+        """Gauges read when scraped, collect returns the value of every `key` label"""
+        with self._lock:
+            self._help[name] = ("gauge", help)
+            self._gauges[name] = collect
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines += self._header(name)
+                lines += [f"{name}{format_labels(key)} {value}" for key, value in series.items()]
+            for name, series in self._histograms.items():
+                lines += self._header(name)
+                for key, values in series.items():
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, values):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {values[-2]}")
+                    lines.append(f"{name}_count{format_labels(key)} {values[-2]}")
+                    lines.append(f"{name}_sum{format_labels(key)} {values[-1]}")
+            gauges = list(self._gauges.items())
+        for name, collect in gauges:
+            lines += self._header(name)
+            lines += [f"{name}{format_labels((('key', key),))} {value}" for key, value in collect().items()]
+        return "\n".join(lines) + "\n"
+
+    def _header(self, name: str) -> list[str]:
+        kind, help = self._help[name]
+        return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+metrics = Metrics()
+
+@contextmanager
+def timed(stage: str):
+    """Times a pipeline stage, usable as a context manager or a decorator
+
+    The duration goes to the stage histogram and to the timings of the current event.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def record_stage(stage: str, seconds: float):
+    metrics.observe("agent_stage_seconds", "Wall time of each pipeline stage", seconds, stage=stage)
+    for listener in stage_listeners:
+        listener(stage, seconds)
+    timings = stage_timings.get()
+    if timings is not None:
+        totals = timings.setdefault(stage, {"count": 0, "seconds": 0.0})
+        totals["count"] += 1
+        totals["seconds"] += seconds
+
+def rounded_timings(timings: dict) -> dict:
+    return {stage: {"count": totals["count"], "seconds": round(totals["seconds"], 3)} for stage, totals in timings.items()}
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Records the latency and token usage of every chat model call made in a graph run"""
+
+    def __init__(self):
+        # run id -> (start, model)
+        self._starts: dict[UUID, tuple[float, Optional[str]]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata: Optional[dict] = None,
+                            invocation_params: Optional[dict] = None, **kwargs):
+        # responses served from the llm cache carry no llm_output, the call itself still names the model
+        params = invocation_params or {}
+        model = (metadata or {}).get("ls_model_name") or params.get("model") or params.get("model_name")
+        self._starts[run_id] = (time.perf_counter(), model)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        start, model = self._starts.pop(run_id, (None, None))
+        if start is not None:
+            record_stage("llm", time.perf_counter() - start)
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        model = model or (response.llm_output or {}).get("model_name", "unknown")
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                metrics.inc("llm_tokens_total", "Tokens used by chat model calls", usage[kind], model=model, kind=kind)
+        metrics.inc("llm_calls_total", "Chat model calls", model=model)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._starts.pop(run_id, None)
+        metrics.inc("llm_errors_total", "Chat model calls that failed", error=type(error).__name__)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics served on :{port}/metrics")
+    return server
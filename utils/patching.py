@@ -0,0 +1,56 @@
+import json
+import os
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+class LineEdit(BaseModel):
+    """Replaces lines start to end of the file, both 1-based and inclusive"""
+    start: int = Field(description="first line replaced")
+    end: int = Field(description="last line replaced, start - 1 to insert before start without replacing")
+    content: str = Field(description="replacement lines, empty to delete the lines")
+
+class PropertyEdit(BaseModel):
+    """Sets or removes one key of a properties file"""
+    key: str
+    value: Optional[str] = Field(description="new value, null to remove the key")
+
+class Patch(BaseModel):
+    """Edits fixing the policy violations of a configuration file"""
+    property_edits: list[PropertyEdit] = Field(default=[], description="only for properties files")
+    line_edits: list[LineEdit] = Field(default=[], description="line numbers of the file as shown")
+
+    @property
+    def empty(self) -> bool:
+        return not self.property_edits and not self.line_edits
+
+def number_lines(content: str) -> str:
+    """Renders the file with line numbers, which line edits refer to"""
+    return "\n".join(f"{number:>4} | {line}" for number, line in enumerate(content.split("\n"), 1))
+
+def apply_patch(content: str, filename: str, patch: Patch) -> str:
+    lines = content.split("\n")
+    line_count = len(lines)
+    # applied bottom up, so every edit refers to the line numbers the model saw
+    previous_start = line_count + 1
+    for edit in sorted(patch.line_edits, key=lambda edit: edit.start, reverse=True):
+        if not 1 <= edit.start <= line_count + 1 or not edit.start - 1 <= edit.end <= line_count:
+            raise ValueError(f"Line edit {edit.start}-{edit.end} is outside of {filename} ({line_count} lines)")
+        if edit.end >= previous_start:
+            raise ValueError(f"Line edit {edit.start}-{edit.end} of {filename} overlaps another edit")
+        replacement = edit.content.split("\n") if edit.content else []
+        lines[edit.start - 1:edit.end] = replacement
+        previous_start = edit.start
+    content = "\n".join(lines)
+
+    if patch.property_edits:
+        if os.path.splitext(filename)[1] != ".json":
+            raise ValueError(f"Property edits only apply to properties files, not {filename}")
+        properties = json.loads(content)
+        for edit in patch.property_edits:
+            if edit.value is None:
+                properties.pop(edit.key, None)
+            else:
+                properties[edit.key] = edit.value
+        content = json.dumps(properties, indent=2)
+    return content
@@ -1,26 +1,90 @@
+import os
 import re
+import threading
+import time
+from typing import Optional
+
 import yaml
 
-def retrieve_policy(filename: str) -> str:
-    with open("policies.yaml") as f:
-        rules = yaml.safe_load(f)
+# filename patterns such as "\.tf$" or "^application\.properties$" can only match a single extension
+EXTENSION_PATTERN = re.compile(r"\\\.([A-Za-z0-9_-]+)\$$")
 
-    try:
-        with open(f"tmp/{filename}", "r") as f:
-            content = f.read()
-    except FileNotFoundError:
-        content = ""
+class PolicyRule:
+    def __init__(self, position: int, rule: dict):
+        self.position = position
+        self.policy = rule["policy"]
+        self.filename_pattern = re.compile(rule["filename_pattern"])
+        content_pattern = rule.get("content_pattern")
+        self.content_pattern = re.compile(content_pattern) if content_pattern else None
 
-    for rule in rules:
-        # Match filename pattern
-        if not re.search(rule["filename_pattern"], filename):
-            continue
+        match = EXTENSION_PATTERN.search(rule["filename_pattern"])
+        self.extension = f".{match.group(1)}" if match and "|" not in rule["filename_pattern"] else None
 
+    def matches(self, filename: str, content: str) -> bool:
+        if not self.filename_pattern.search(filename):
+            return False
         # If there's a content pattern, check that too
-        content_pattern = rule.get("content_pattern")
-        if content_pattern and not re.search(content_pattern, content):
-            continue
+        return not self.content_pattern or bool(self.content_pattern.search(content))
+
+class PolicyRegistry:
+    """Compiled, extension-indexed view of policies.yaml
+
+    The file is stat'ed at most every reload_interval seconds and reloaded when it changes.
+    """
+
+    def __init__(self, path: str = "policies.yaml", reload_interval: float = 2.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._by_extension: dict[str, list[PolicyRule]] = {}
+        self._any_extension: list[PolicyRule] = []
+
+    def match(self, filename: str, content: str = "") -> list[str]:
+        """Returns every policy whose rule matches the file, in the order of policies.yaml"""
+        by_extension, any_extension = self._snapshot()
+        candidates = by_extension.get(os.path.splitext(filename)[1], []) + any_extension
+        candidates.sort(key=lambda rule: rule.position)
+
+        policies = []
+        for rule in candidates:
+            if rule.policy not in policies and rule.matches(filename, content):
+                policies.append(rule.policy)
+        return policies
+
+    def _snapshot(self) -> tuple[dict[str, list[PolicyRule]], list[PolicyRule]]:
+        with self._lock:
+            now = time.time()
+            if self._mtime is None or now - self._checked_at >= self.reload_interval:
+                self._checked_at = now
+                mtime = os.stat(self.path).st_mtime
+                if mtime != self._mtime:
+                    self._load()
+                    self._mtime = mtime
+            return self._by_extension, self._any_extension
+
+    def _load(self):
+        with open(self.path) as f:
+            rules = [PolicyRule(position, rule) for position, rule in enumerate(yaml.safe_load(f) or [])]
+
+        by_extension: dict[str, list[PolicyRule]] = {}
+        any_extension = []
+        for rule in rules:
+            if rule.extension:
+                by_extension.setdefault(rule.extension, []).append(rule)
+            else:
+                any_extension.append(rule)
+        self._by_extension = by_extension
+        self._any_extension = any_extension
+
+policy_registry = PolicyRegistry(os.getenv("POLICIES_FILE", "policies.yaml"), float(os.getenv("POLICY_RELOAD_INTERVAL", "2")))
 
-        return rule["policy"]
+def retrieve_policies(filename: str, content: str = "") -> list[str]:
+    policies = policy_registry.match(filename, content)
+    if not policies:
+        raise Exception(f"No matching policy found for {filename}")
+    return policies
 
-    raise Exception(f"No matching policy found for {filename}")
+def retrieve_policy(filename: str, content: str = "") -> str:
+    return retrieve_policies(filename, content)[0]
@@ -0,0 +1,238 @@
+import atexit
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import requests
+from pydantic import BaseModel
+
+from utils.cache import LRUCache, content_hash, files_hash
+
+# rule name prefixes conftest queries, and how a non-empty result is counted
+RULE_KINDS = {"deny": "failures", "violation": "failures", "warn": "warnings"}
+
+class PolicyResult(BaseModel):
+    """Outcome of testing one file against a policy, mirroring conftest's json output"""
+    filename: str
+    policy_paths: list[str]
+    namespace: str = "main"
+    successes: int = 0
+    failures: list[str] = []
+    warnings: list[str] = []
+    exceptions: list[str] = []
+
+    @property
+    def total_tests(self) -> int:
+        return self.successes + len(self.failures) + len(self.warnings) + len(self.exceptions)
+
+    @property
+    def compliant(self) -> bool:
+        return self.total_tests > 0 and not self.failures and not self.exceptions
+
+    def summary(self) -> dict:
+        return {
+            "total_tests": self.total_tests,
+            "passed": self.successes,
+            "warnings": len(self.warnings),
+            "failures": len(self.failures),
+            "exceptions": len(self.exceptions)
+        }
+
+class ConftestEngine:
+    """Evaluates policies by running the conftest cli, which loads and compiles them on every call"""
+
+    name = "conftest"
+
+    def evaluate(self, path: str, policy_paths: list[str]) -> PolicyResult:
+        return self.evaluate_batch([path], policy_paths)[path]
+
+    def evaluate_batch(self, paths: list[str], policy_paths: list[str]) -> dict[str, PolicyResult]:
+        # every policy is in package main, so conftest merges their rules into one policy set
+        policy_args = [arg for policy_path in policy_paths for arg in ("--policy", policy_path)]
+        result = subprocess.run(
+            ["conftest", "test", "--output", "json", *policy_args, *paths],
+            capture_output=True
+        )
+        results = {}
+        for entry in json.loads(result.stdout.decode("utf-8") or "[]"):
+            results[entry["filename"]] = _merge_result(results.get(entry["filename"]), entry, policy_paths)
+        for path in paths:
+            if path not in results:
+                error = result.stderr.decode("utf-8").strip() or "conftest produced no result"
+                results[path] = PolicyResult(filename=path, policy_paths=policy_paths, exceptions=[error])
+        return results
+
+class OPAServerEngine:
+    """Evaluates policies against a long-lived OPA server that keeps them compiled between calls
+
+    Uses the server at OPA_URL when set, otherwise starts `opa run --server` on OPA_ADDR.
+    Every set of policies evaluated together is uploaded under its own package, so sets sharing
+    `package main` stay isolated, and is only re-uploaded when one of its files changes.
+    """
+
+    name = "opa"
+
+    def __init__(self, url: Optional[str] = None):
+        self.session = requests.Session()
+        self.process = None
+        self.url = url or os.getenv("OPA_URL")
+        if not self.url:
+            addr = os.getenv("OPA_ADDR", "127.0.0.1:8181")
+            self.url = f"http://{addr}"
+            self.process = subprocess.Popen(
+                [os.getenv("OPA_BINARY", "opa"), "run", "--server", "--addr", addr, "--log-level", "error"],
+                stdout=subprocess.DEVNULL
+            )
+            atexit.register(self.process.terminate)
+        self._wait_until_healthy()
+
+        self._lock = threading.Lock()
+        # policy files -> (digest, package, number of deny/violation/warn rule bodies)
+        self._packages: dict[tuple, tuple[str, str, int]] = {}
+        # non json inputs are converted with `conftest parse`, once per distinct content
+        self._documents = LRUCache(int(os.getenv("OPA_DOCUMENT_CACHE_SIZE", "256")))
+
+    def evaluate(self, path: str, policy_paths: list[str]) -> PolicyResult:
+        result = PolicyResult(filename=path, policy_paths=policy_paths)
+        try:
+            document = self._load_document(path)
+            package, rule_count = self._ensure_policies(policy_paths)
+            res = self.session.post(f"{self.url}/v1/data/{package.replace('.', '/')}", json={"input": document})
+            res.raise_for_status()
+        except Exception as e:
+            result.exceptions.append(str(e))
+            return result
+
+        # every result message is a failure/warning
+        for rule, values in res.json().get("result", {}).items():
+            kind = rule_kind(rule)
+            if kind is None:
+                continue
+            for value in values:
+                getattr(result, kind).append(value["msg"] if isinstance(value, dict) else str(value))
+        # counted like conftest: every rule body is a test, and those without a result passed
+        result.successes = max(rule_count - len(result.failures) - len(result.warnings), 0)
+        return result
+
+    def evaluate_batch(self, paths: list[str], policy_paths: list[str]) -> dict[str, PolicyResult]:
+        return {path: self.evaluate(path, policy_paths) for path in paths}
+
+    def _wait_until_healthy(self, timeout: float = 10):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if self.session.get(f"{self.url}/health", timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"OPA server at {self.url} did not become healthy")
+            time.sleep(0.1)
+
+    def _ensure_policies(self, policy_paths: list[str]) -> tuple[str, int]:
+        """Uploads the policy set if it changed, returns its package and its number of rule bodies"""
+        key = tuple(sorted(policy_paths))
+        digest = files_hash(key)
+        with self._lock:
+            uploaded = self._packages.get(key)
+            if uploaded and uploaded[0] == digest:
+                return uploaded[1], uploaded[2]
+
+            # modules declaring the same package are merged by opa, so the set is evaluated with one query
+            package = f"cg.p{digest[:16]}"
+            rule_count = 0
+            for index, policy_path in enumerate(key):
+                with open(policy_path, "r") as f:
+                    module = re.sub(r"^package\s+\S+", f"package {package}", f.read(), count=1, flags=re.MULTILINE)
+                res = self.session.put(f"{self.url}/v1/policies/{package}/{index}", data=module.encode("utf-8"),
+                                       headers={"Content-Type": "text/plain"})
+                res.raise_for_status()
+                # the parsed module tells the rule bodies apart, the way conftest counts its tests
+                res = self.session.get(f"{self.url}/v1/policies/{package}/{index}")
+                res.raise_for_status()
+                rule_count += sum(1 for rule in res.json()["result"]["ast"].get("rules", []) if rule_kind(rule_name(rule)))
+
+            # the previous version of the set would otherwise stay loaded on the server
+            if uploaded and uploaded[1] != package:
+                for index in range(len(key)):
+                    self.session.delete(f"{self.url}/v1/policies/{uploaded[1]}/{index}")
+            self._packages[key] = (digest, package, rule_count)
+            return package, rule_count
+
+    def _load_document(self, path: str):
+        with open(path, "r") as f:
+            content = f.read()
+        if path.endswith(".json"):
+            return json.loads(content)
+
+        key = (content_hash(content), os.path.splitext(path)[1])
+        document = self._documents.get(key)
+        if document is None:
+            result = subprocess.run(["conftest", "parse", "--combine", path], capture_output=True, check=True)
+            parsed = json.loads(result.stdout.decode("utf-8"))
+            # --combine wraps every file as {"path", "contents"}
+            document = parsed[0]["contents"] if isinstance(parsed, list) else parsed
+            self._documents.put(key, document)
+        return document
+
+def rule_kind(rule: str) -> Optional[str]:
+    """failures or warnings for the rules conftest queries, None for any other rule"""
+    return next((kind for prefix, kind in RULE_KINDS.items() if rule == prefix or rule.startswith(f"{prefix}_")), None)
+
+def rule_name(rule: dict) -> str:
+    # rules with a ref head, like `deny contains msg if`, only carry the name as the first ref term
+    head = rule["head"]
+    return head.get("name") or head["ref"][0]["value"]
+
+def _merge_result(merged: Optional[PolicyResult], entry: dict, policy_paths: list[str]) -> PolicyResult:
+    # conftest reports one entry per file and namespace
+    result = PolicyResult(
+        filename=entry["filename"],
+        policy_paths=policy_paths,
+        namespace=entry.get("namespace", "main"),
+        successes=entry.get("successes", 0),
+        failures=[item["msg"] for item in entry.get("failures") or []],
+        warnings=[item["msg"] for item in entry.get("warnings") or []],
+        exceptions=[item["msg"] for item in entry.get("exceptions") or []],
+    )
+    if merged is None:
+        return result
+    merged.successes += result.successes
+    merged.failures += result.failures
+    merged.warnings += result.warnings
+    merged.exceptions += result.exceptions
+    return merged
+
+def format_result(result: PolicyResult) -> str:
+    """Renders a result the way conftest prints it on the console"""
+    lines = []
+    for messages, label in ((result.warnings, "WARN"), (result.failures, "FAIL"), (result.exceptions, "EXCP")):
+        for message in messages:
+            lines.append(f"{label} - {result.filename} - {result.namespace} - {message}")
+
+    summary = result.summary()
+    lines.append("")
+    lines.append(f"{summary['total_tests']} tests, {summary['passed']} passed, {summary['warnings']} warnings, "
+                 f"{summary['failures']} failures, {summary['exceptions']} exceptions")
+    return "\n".join(lines) + "\n"
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_policy_engine():
+    """Returns the engine selected by POLICY_ENGINE (conftest or opa), created on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            match os.getenv("POLICY_ENGINE", "conftest"):
+                case "opa":
+                    _engine = OPAServerEngine()
+                case "conftest":
+                    _engine = ConftestEngine()
+                case other:
+                    raise ValueError(f"Unknown POLICY_ENGINE {other}")
+        return _engine
@@ -0,0 +1,189 @@
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.github_pr import create_batch_pr_body, create_remediation_pr
+from utils.metrics import metrics, timed
+
+class CountingRetry(Retry):
+    # urllib3 calls increment once for every retried request
+    def increment(self, method=None, url=None, *args, **kwargs):
+        metrics.inc("publish_retries_total", "Publishing requests retried", method=method or "")
+        return super().increment(method, url, *args, **kwargs)
+
+def make_session(pool_size: int) -> requests.Session:
+    """Keep-alive session retrying connection errors and 429/5xx responses with exponential backoff
+
+    Only idempotent methods are retried once the request was sent, a report posted again after
+    a 502 that hachiware had already accepted would become a second approval request.
+    """
+    retry = CountingRetry(
+        total=int(os.getenv("PUBLISH_RETRIES", "3")),
+        backoff_factor=float(os.getenv("PUBLISH_BACKOFF", "0.5")),
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class Publisher:
+    """Background stage sending reports to hachiware and opening remediation PRs
+
+    Workers hand their results over and move on to the next event while the publisher
+    threads deliver them, so slow GitHub calls no longer hold up remediation.
+    Patches for one repository arriving within pr_window seconds of the first go into a single PR.
+
+    An event is held from begin until end and until everything it published was delivered, then
+    on_published is called with its id. Events whose delivery failed are not passed on, so they
+    stay in the journal and are published again after a restart.
+    """
+
+    def __init__(self, endpoint: str, workers: int = 2, max_pending: int = 64, pr_window: float = 30,
+                 on_published: Optional[Callable[[str], None]] = None):
+        self.endpoint = endpoint
+        self.pr_window = pr_window
+        self.on_published = on_published
+        self._events_lock = threading.Lock()
+        # event id -> holds not released yet, the worker handling it has one and every job another
+        self._events: dict[str, int] = {}
+        self._failed: set[str] = set()
+        self.session = make_session(workers)
+        self._batches_lock = threading.Lock()
+        # repository -> (path -> (patched content, pr body), events held by the batch, timer flushing it)
+        self._batches: dict[str, tuple[dict[str, tuple[str, str]], list[str], threading.Timer]] = {}
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"publisher-{index}", daemon=True) for index in range(workers)
+        ]
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            for thread in self._threads:
+                thread.start()
+
+    def begin(self, event_id: str):
+        with self._events_lock:
+            self._events[event_id] = self._events.get(event_id, 0) + 1
+
+    def end(self, event_id: str):
+        """Called by the worker once it published everything for the event"""
+        self._release([event_id], True)
+
+    def publish_report(self, attributes: dict, event_id: Optional[str] = None):
+        self._put("publish_report", [event_id] if event_id else [], self._post_report, attributes)
+
+    def publish_pr(self, file_content: str, original_file_path: str, repo_full_name: str, pr_body: str,
+                   event_id: Optional[str] = None):
+        # the batch only lives in memory, so its events stay journaled until the PR is opened
+        if event_id:
+            self.begin(event_id)
+        with self._batches_lock:
+            batch = self._batches.get(repo_full_name)
+            if batch is None:
+                timer = threading.Timer(self.pr_window, self._flush, [repo_full_name])
+                timer.daemon = True
+                batch = self._batches[repo_full_name] = ({}, [], timer)
+                timer.start()
+            # a later patch of the same file replaces the earlier one, both events wait for the PR
+            batch[0][original_file_path] = (file_content, pr_body)
+            if event_id:
+                batch[1].append(event_id)
+
+    def shutdown(self):
+        """Delivers everything queued, then stops the threads"""
+        if not self._started:
+            return
+        with self._batches_lock:
+            pending = list(self._batches)
+        for repo_full_name in pending:
+            self._flush(repo_full_name)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _flush(self, repo_full_name: str):
+        with self._batches_lock:
+            batch = self._batches.pop(repo_full_name, None)
+        if batch is None:
+            return
+        files, event_ids, timer = batch
+        timer.cancel()
+        title = "Automated Remediation Patch" if len(files) == 1 else f"Automated Remediation Patch ({len(files)} files)"
+        try:
+            self._put("publish_pr", event_ids, create_remediation_pr,
+                {path: content for path, (content, _) in files.items()},
+                repo_full_name,
+                pr_title=title,
+                pr_body=create_batch_pr_body({path: body for path, (_, body) in files.items()})
+            )
+        finally:
+            # the queued job holds the events from here on
+            self._release(event_ids, True)
+
+    def _put(self, stage: str, event_ids: list[str], func: Callable, *args, **kwargs):
+        for event_id in event_ids:
+            self.begin(event_id)
+        # blocks when publishing falls behind, which holds up the workers rather than growing the queue
+        self._queue.put((stage, event_ids, func, args, kwargs))
+
+    def _release(self, event_ids: list[str], delivered: bool):
+        published = []
+        with self._events_lock:
+            for event_id in event_ids:
+                if not delivered:
+                    self._failed.add(event_id)
+                self._events[event_id] -= 1
+                if self._events[event_id] == 0:
+                    del self._events[event_id]
+                    if event_id in self._failed:
+                        self._failed.discard(event_id)
+                        print(f"Event {event_id} was not fully published, it is retried after a restart")
+                    else:
+                        published.append(event_id)
+        for event_id in published:
+            try:
+                if self.on_published:
+                    self.on_published(event_id)
+            except Exception:
+                logging.exception(f"Completing event {event_id} failed")
+
+    def _post_report(self, attributes: dict):
+        res = self.session.post(f"{self.endpoint}/api/report",
+            json={ "data": { "attributes": attributes }},
+            headers={"Content-Type": "application/vnd.api+json"},
+            timeout=float(os.getenv("PUBLISH_TIMEOUT", "30"))
+        )
+        if res.status_code >= 400:
+            print(res.text)
+        # the event stays journaled and its report is posted again after a restart
+        if res.status_code >= 500:
+            res.raise_for_status()
+
+    def _run(self):
+        while True:
+            job: Optional[tuple] = self._queue.get()
+            if job is None:
+                return
+            stage, event_ids, func, args, kwargs = job
+            delivered = False
+            try:
+                with timed(stage):
+                    func(*args, **kwargs)
+                delivered = True
+            except Exception:
+                metrics.inc("publish_errors_total", "Reports and PRs that could not be published", stage=stage)
+                logging.exception("Publishing failed")
+            finally:
+                self._release(event_ids, delivered)
@@ -1,115 +1,87 @@
-import os
-import re
+from collections import Counter
 from typing import Optional
 
 from datetime import datetime
-from langchain_core.messages import AIMessage, ToolMessage
-from langgraph.graph import MessagesState
-
-def analyze_changes(original_filename: str, patched_filename: str) -> dict:
-    """Analyze changes between original and patched content"""
-
-    with open(f"tmp/{original_filename}", "r") as f:
-         original_content = f.read()
-    with open(f"tmp/{patched_filename}", "r") as f:
-         patched_content = f.read()
-
-    changes_detail = []
-    
-    original_lines = [line.strip() for line in original_content.split('\n') if line.strip()]
-    patched_lines = [line.strip() for line in patched_content.split('\n') if line.strip()]
-    
-    # Find lines that are in patched but not in original (ADDED)
-    for line in patched_lines:
-        if line not in original_lines:
-            changes_detail.append({
-                "type": "ADDED",
-                "content": line,
-                "description": f"Added: {line}"
-            })
-    
-    # Find lines that are in original but not in patched (REMOVED)
-    for line in original_lines:
-        if line not in patched_lines:
-            changes_detail.append({
-                "type": "REMOVED",
-                "content": line,
-                "description": f"Removed: {line}"
-            })
-    
+from utils.policy_engine import PolicyResult, format_result
+
+def analyze_changes(original_content: str, patched_content: str) -> dict:
+    """Analyze changes between original and patched content
+
+    Lines are compared ignoring indentation, and every change carries its line number in the
+    original (REMOVED) or patched (ADDED) file. Lines are matched by count in a single pass, so
+    a line that only moved is not reported and large files stay linear.
+    """
+
+    original_lines = [line.strip() for line in original_content.split('\n')]
+    patched_lines = [line.strip() for line in patched_content.split('\n')]
+
+    removed = unmatched_lines(original_lines, Counter(patched_lines))
+    added = unmatched_lines(patched_lines, Counter(original_lines))
+
+    changes_detail = [{
+        "type": "REMOVED",
+        "line": number,
+        "content": line,
+        "description": f"Removed line {number}: {line}"
+    } for number, line in removed] + [{
+        "type": "ADDED",
+        "line": number,
+        "content": line,
+        "description": f"Added line {number}: {line}"
+    } for number, line in added]
+
     return {
         "total_changes": len(changes_detail),
         "changes_detail": changes_detail
     }
 
-def parse_validation_output(validation_output: str) -> dict:
-    """Parse conftest validation output to extract test statistics"""
-    lines = validation_output.strip().split('\n')
-    test_summary = None
-    
-    for line in lines:
-        if "tests," in line and "passed" in line:
-            clean_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
-            # Extract numbers from clean line like "4 tests, 3 passed, 0 warnings, 1 failure, 0 exceptions"
-            numbers = re.findall(r'\d+', clean_line)
-            
-            if len(numbers) >= 5:
-                test_summary = {
-                    "total_tests": int(numbers[0]),
-                    "passed": int(numbers[1]),
-                    "warnings": int(numbers[2]),
-                    "failures": int(numbers[3]),
-                    "exceptions": int(numbers[4])
-                }
-            break
-    
-    return test_summary or {"total_tests": 0, "passed": 0, "warnings": 0, "failures": 0, "exceptions": 0}
-
-def generate_report(remediation_start: datetime, messages: list[MessagesState], remote_filename: str, parsed_patched_content: Optional[str] = None):
-
-    ai_messages = []
-    tool_messages = []
-
-    for message in messages:
-        if isinstance(message, AIMessage):
-            ai_messages.append(message)
-        elif isinstance(message, ToolMessage):
-            tool_messages.append(message)
-
-    first_tool_call = ai_messages[0].tool_calls[0]
-    filename = first_tool_call["args"]["filename"]
-    policy_path = first_tool_call["args"]["policy_path"]
-
-    base_name = os.path.splitext(filename)[0]
-    extension = os.path.splitext(filename)[1]
-    patched_filename = f"{base_name}_patched{extension}"
-
-    # Find first and last tool call message
-    original_validation_output = str(tool_messages[0].content)
-    validation_output = "" if len(tool_messages) == 1 else str(tool_messages[-1].content)
-
-    original_test_summary = parse_validation_output(original_validation_output)
-
-    violations_detected = original_validation_output.count("FAIL") if "FAIL" in original_validation_output else 0
-    violated_policies = [line.split("-")[-1] for line in original_validation_output.split("\n")[:-3]]
+def unmatched_lines(lines: list[str], other: Counter) -> list[tuple[int, str]]:
+    """Non-empty lines, with their 1-based number, occurring more often than in other"""
+    unmatched = []
+    for number, line in enumerate(lines, start=1):
+        if not line:
+            continue
+        if other[line] > 0:
+            other[line] -= 1
+        else:
+            unmatched.append((number, line))
+    return unmatched
+
+def generate_report(remediation_start: datetime, remote_filename: str, original_content: str,
+                    original_result: PolicyResult, patched_result: Optional[PolicyResult] = None,
+                    patched_content: Optional[str] = None, parsed_patched_content: Optional[str] = None,
+                    deterministic_fixes: Optional[list[str]] = None, convergence: Optional[dict] = None,
+                    transcript: Optional[list[dict]] = None):
+    """Builds the approval request from the evaluation of the original and latest patched file
+
+    Contents are in the conftest input format (json for properties files).
+    """
+
+    policy_path = ", ".join(original_result.policy_paths)
+
+    original_validation_output = format_result(original_result).replace(original_result.filename, remote_filename)
+    validation_output = ""
+    if patched_result is not None:
+        validation_output = format_result(patched_result).replace(patched_result.filename, remote_filename)
+
+    violations_detected = len(original_result.failures)
+    violated_policies = original_result.failures
 
     # Track timing
     remediation_end = datetime.now()
     total_duration = (remediation_end - remediation_start).total_seconds()
 
-    patched_content = "No patch was generated"
     patched_test_summary = None
     changes_summary = {
         "total_changes": 0,
         "changes_detail": None
     }
-    if violations_detected and os.path.exists(f"tmp/{patched_filename}"):
+    if violations_detected and patched_content is not None:
         # Analyze changes between original and patched content
-        changes_summary = analyze_changes(filename, patched_filename)
-
-        patched_test_summary = parse_validation_output(validation_output)
-        with open(f"tmp/{patched_filename}", "r") as f:
-             patched_content = f.read()
+        changes_summary = analyze_changes(original_content, patched_content)
+        patched_test_summary = patched_result.summary() if patched_result else None
+    else:
+        patched_content = "No patch was generated"
 
     # Create approval request
     approval_data = {
@@ -118,20 +90,27 @@ def generate_report(remediation_start: datetime, messages: list[MessagesState],
         "policy_compliance": {
             "violations_detected": violations_detected,
             "validation_status": "FAILED" if violations_detected > 0 else "PASSED",
-            "policy_file_used": policy_path
+            "policy_file_used": policy_path,
+            # violations fixed by the rule based fixes in utils/fixes.py rather than the agents
+            "deterministic_fixes": deterministic_fixes or []
         },
         "changes_summary": changes_summary,
         "violations_analysis": {
-            "raw_violations": original_validation_output.replace(f'tmp/{filename}', remote_filename)
+            "raw_violations": original_validation_output
         },
         "validation_details": {
-            "original_file_validation": original_validation_output.replace(f'tmp/{filename}', remote_filename),
+            "original_file_validation": original_validation_output,
             "patched_file_validation": validation_output,
-            "original_tests_summary": original_test_summary,
+            "original_tests_summary": original_result.summary(),
             "patched_tests_summary": patched_test_summary
         },
+        # iterations of the monitoring/remediation loop and why it stopped, None when the agents did not run
+        "convergence": convergence,
+        # every agent message, the agents themselves only saw a compacted view
+        "transcript": transcript,
         "policy_details": {
             "policy_file": policy_path,
+            "policy_files": original_result.policy_paths,
             "specific_rules": violated_policies
         },
         "timing": {
@@ -0,0 +1,60 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+class KeyedWorkerPool:
+    """Bounded thread pool where jobs sharing a key run one after another, in submission order"""
+
+    def __init__(self, max_workers: int, max_pending: Optional[int] = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-worker")
+        # caps queued + running jobs so a burst of events applies backpressure to the reader
+        self._slots = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self._lock = threading.Lock()
+        self._queues: dict[str, deque] = {}
+
+    def submit(self, key: Optional[str], func: Callable, *args):
+        self._slots.acquire()
+        job = (func, args)
+
+        if key is None:
+            self._executor.submit(self._run, job)
+            return
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                # a worker is already draining this key, it will pick the job up
+                queue.append(job)
+                return
+            self._queues[key] = deque([job])
+        self._executor.submit(self._drain, key)
+
+    def shutdown(self, cancel: bool = False):
+        """Waits for queued and running jobs to finish, or drops queued jobs when cancel is set"""
+        if cancel:
+            with self._lock:
+                for queue in self._queues.values():
+                    queue.clear()
+        self._executor.shutdown(wait=not cancel, cancel_futures=cancel)
+
+    def _drain(self, key: str):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                job = queue.popleft()
+            self._run(job)
+
+    def _run(self, job):
+        func, args = job
+        try:
+            func(*args)
+        except (Exception, SystemExit):
+            # file conversion helpers sys.exit on bad input, which must not kill the worker
+            logging.exception("Event processing failed")
+        finally:
+            self._slots.release()
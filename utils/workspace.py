@@ -0,0 +1,56 @@
+import contextvars
+import os
+import re
+import shutil
+import uuid
+from typing import Iterable, Optional
+
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "tmp")
+# workspaces live in a directory of their own, so cleaning up never touches whatever else is in WORKSPACE_ROOT
+WORKSPACES_DIR = os.path.join(WORKSPACE_ROOT, "agent-workspaces")
+# stands for the job workspace in anything cached across jobs, tool output mentions the workspace path
+WORKSPACE_PLACEHOLDER = "$WORKSPACE"
+# root of the workspace of the job running in this context
+current_workspace: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_workspace", default=None)
+
+class Workspace:
+    """Scratch directory private to a single job, removed once the job completes
+
+    Jobs resumed after a restart pass the same job_id to find the files of the interrupted run.
+    A kept workspace outlives the with block and is removed by whoever completes the job.
+    """
+
+    def __init__(self, job_id: Optional[str] = None, keep: bool = False):
+        self.job_id = workspace_id(job_id) if job_id else uuid.uuid4().hex
+        self.keep = keep
+        self.root = os.path.join(WORKSPACES_DIR, self.job_id)
+        self._token = None
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.root, filename)
+
+    def cleanup(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        os.makedirs(self.root, exist_ok=True)
+        self._token = current_workspace.set(self.root)
+        return self
+
+    def __exit__(self, *exc):
+        current_workspace.reset(self._token)
+        if not self.keep:
+            self.cleanup()
+
+def workspace_id(job_id: str) -> str:
+    # event ids come from the sse server and may contain path separators
+    return re.sub(r"[^\w.-]", "_", job_id)
+
+def cleanup_stale_workspaces(keep: Iterable[str] = ()):
+    """Removes workspaces left behind by a previous process that did not exit cleanly, except the jobs in keep"""
+    if not os.path.isdir(WORKSPACES_DIR):
+        return
+    kept = {workspace_id(job_id) for job_id in keep}
+    for entry in os.listdir(WORKSPACES_DIR):
+        if entry not in kept and entry == workspace_id(entry) and os.path.isdir(os.path.join(WORKSPACES_DIR, entry)):
+            shutil.rmtree(os.path.join(WORKSPACES_DIR, entry), ignore_errors=True)